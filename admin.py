@@ -5,11 +5,22 @@ Contains administrative routes for user management, folder management, and syste
 
 import os
 import json
+import bisect
+import hmac
 from flask import Blueprint, request, render_template, redirect, url_for, session, flash, current_app
 from werkzeug.security import check_password_hash
 
-from scripts.db import get_all_shares, create_admin_user, get_user_by_username, check_admin_exists, get_share, add_share
-from helpers import calculate_md5, get_folder_size, format_size, _
+from scripts.db import get_all_shares, create_admin_user, get_user_by_username, check_admin_exists, get_share, get_share_md5s, add_share, get_index_job, cache_stats
+from scripts.metrics import render_metrics
+from scripts.indexer import start_indexing
+from scripts.pages import render_page, page_cache_stats
+from scripts.search import search
+from scripts.scanner import scan_tree, read_dir, read_dirs, get_folder_size, cache_stats as dir_cache_stats
+from helpers import calculate_md5, format_size, resolve_upload_path, _
+
+# Default and maximum number of folders returned per page by the lazy folder API
+FOLDER_PAGE_SIZE = 200
+FOLDER_PAGE_SIZE_MAX = 1000
 
 # Create blueprint for admin routes
 admin_bp = Blueprint('admin', __name__)
@@ -30,8 +41,8 @@ def register_admin():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        create_admin_user(current_app, username, password)
-        flash(_('admin_created_please_login'))
+        if create_admin_user(current_app, username, password):
+            flash(_('admin_created_please_login'))
         return redirect(url_for('admin.login'))
     
     return render_template('register_admin.html')
@@ -98,7 +109,7 @@ def admin_folders():
     """
     if not session.get('admin_logged_in'):
         return redirect(url_for('admin.login'))
-    return render_template('admin_folders.html')
+    return render_page('admin_folders.html')
 
 
 @admin_bp.route('/admin/shares')
@@ -114,7 +125,8 @@ def admin_shares():
         return redirect(url_for('admin.login'))
 
     shares = get_all_shares(current_app)
-    return render_template('admin_shares.html', shares=shares)
+    # Shares are only ever added, so their MD5s version the page
+    return render_page('admin_shares.html', (tuple(share['md5'] for share in shares),), shares=shares)
 
 
 @admin_bp.route('/admin/config-check')
@@ -143,7 +155,8 @@ def config_check():
 def admin_folder_tree():
     """
     Get folder tree structure as JSON for the admin interface.
-    Recursively scans the upload folder and returns folder hierarchy with sizes.
+    Scans the upload folder once, summing sizes bottom-up; unchanged directories
+    are served from the scanner's size cache.
 
     Returns:
         JSON response with folder tree structure or redirect to login
@@ -151,50 +164,115 @@ def admin_folder_tree():
     if not session.get('admin_logged_in'):
         return redirect(url_for('admin.login'))
 
-    def get_folder_tree(path):
+    root = current_app.config['UPLOAD_FOLDER']
+    share_md5s = get_share_md5s(current_app)
+
+    def build_node(node):
         """
-        Recursively build folder tree structure.
+        Convert a scanned folder node into the JSON structure used by the UI.
 
         Args:
-            path (str): Path to scan
+            node (dict): Node returned by the folder scanner
 
         Returns:
-            list: List of folder dictionaries with metadata
+            dict: Folder dictionary with metadata
         """
-        tree = []
-        try:
-            for entry in os.scandir(path):
-                if entry.is_dir():
-                    subtree = get_folder_tree(entry.path)
-                    folder_size = get_folder_size(entry.path)
-                    rel_path = os.path.relpath(entry.path, current_app.config['UPLOAD_FOLDER'])
-                    md5 = calculate_md5(entry.path)
-
-                    # Check if folder is already shared
-                    is_shared = get_share(current_app, md5) is not None
-
-                    tree.append({
-                        'name': entry.name,
-                        'path': rel_path,
-                        'size': format_size(folder_size),
-                        'size_bytes': folder_size,
-                        'is_shared': is_shared,
-                        'md5': md5,
-                        'children': subtree
-                    })
-        except PermissionError:
-            pass
-        return tree
+        md5 = calculate_md5(node['path'])
+
+        return {
+            'name': node['name'],
+            'path': os.path.relpath(node['path'], root),
+            'size': format_size(node['size_bytes']),
+            'size_bytes': node['size_bytes'],
+            'is_shared': md5 in share_md5s,
+            'md5': md5,
+            'children': [build_node(child) for child in node['children']]
+        }
+
+    tree = scan_tree(root)
+    return json.dumps([build_node(child) for child in tree['children']], ensure_ascii=False)
+
+
+@admin_bp.route('/admin/folder-children')
+def admin_folder_children():
+    """
+    Get one level of the folder tree as JSON for the admin interface.
+    Only the requested directory is listed, with cursor-based pagination.
+    Folder sizes are not computed here, see admin_folder_sizes().
+
+    Query args:
+        path (str): Folder path relative to the upload folder (empty for the root)
+        cursor (str): Name of the last folder of the previous page
+        limit (int): Maximum number of folders to return
+
+    Returns:
+        JSON response with folders and the next cursor or redirect to login
+    """
+    if not session.get('admin_logged_in'):
+        return redirect(url_for('admin.login'))
+
+    root = current_app.config['UPLOAD_FOLDER']
+    rel_path = request.args.get('path', '')
+    abs_path = resolve_upload_path(root, rel_path)
+    if abs_path is None or not os.path.isdir(abs_path):
+        return {'success': False, 'error': 'not a directory'}, 400
+
+    cursor = request.args.get('cursor')
+    limit = max(1, min(request.args.get('limit', FOLDER_PAGE_SIZE, type=int), FOLDER_PAGE_SIZE_MAX))
+
+    _files_size, subdirs = read_dir(abs_path)
+    start = bisect.bisect_right(subdirs, cursor) if cursor else 0
+    page = subdirs[start:start + limit]
+
+    share_md5s = get_share_md5s(current_app)
+    child_paths = [os.path.join(abs_path, name) for name in page]
+    folders = []
+    for name, child_path, (_child_files_size, child_subdirs) in zip(page, child_paths, read_dirs(child_paths)):
+        md5 = calculate_md5(child_path)
+        folders.append({
+            'name': name,
+            'path': os.path.relpath(child_path, root),
+            'is_shared': md5 in share_md5s,
+            'md5': md5,
+            'child_count': len(child_subdirs),
+            'has_children': bool(child_subdirs)
+        })
+
+    next_cursor = page[-1] if start + limit < len(subdirs) else None
+    return json.dumps({'folders': folders, 'next_cursor': next_cursor}, ensure_ascii=False)
+
+
+@admin_bp.route('/admin/folder-sizes', methods=['POST'])
+def admin_folder_sizes():
+    """
+    Get sizes of several folders as JSON.
+    Accepts JSON data with a list of folder paths relative to the upload folder.
+    Used by the admin interface to fill in sizes after a tree level is shown.
 
+    Returns:
+        JSON response mapping relative paths to sizes or error message
+    """
+    if not session.get('admin_logged_in'):
+        return {'success': False, 'error': 'not authorized'}, 401
+
+    data = request.get_json(silent=True) or {}
     root = current_app.config['UPLOAD_FOLDER']
-    return json.dumps(get_folder_tree(root), ensure_ascii=False)
+    sizes = {}
+    for rel_path in data.get('paths', []):
+        abs_path = resolve_upload_path(root, rel_path)
+        if abs_path is None:
+            continue
+        folder_size = get_folder_size(abs_path)
+        sizes[rel_path] = {'size': format_size(folder_size), 'size_bytes': folder_size}
+    return json.dumps(sizes, ensure_ascii=False)
 
 
 @admin_bp.route('/admin/share-folder', methods=['POST'])
 def share_folder():
     """
     Create a new share for a folder.
-    Accepts JSON data with folder path and creates a share entry.
+    Accepts JSON data with folder path, creates a share entry
+    and queues background indexing of the folder's files.
 
     Returns:
         JSON response with success status or error message
@@ -220,4 +298,123 @@ def share_folder():
     except Exception as e:
         return {'success': False, 'error': str(e)}, 500
 
-    return {'success': True}
+    start_indexing(current_app._get_current_object(), md5, abs_path)
+    return {'success': True, 'md5': md5}
+
+
+@admin_bp.route('/admin/reindex/<md5>', methods=['POST'])
+def reindex_share(md5):
+    """
+    Queue incremental re-indexing of a share.
+    Only directories that changed since the previous indexing are rescanned,
+    and every indexed file is stat'ed once to find files changed in place.
+
+    Args:
+        md5 (str): MD5 hash of the share
+
+    Returns:
+        JSON response with success status or error message
+    """
+    if not session.get('admin_logged_in'):
+        return {'success': False, 'error': 'not authorized'}, 401
+
+    share = get_share(current_app, md5)
+    if share is None:
+        return {'success': False, 'error': 'share not found'}, 404
+
+    start_indexing(current_app._get_current_object(), md5, share['path'], recheck=True)
+    return {'success': True, 'md5': md5}
+
+
+@admin_bp.route('/admin/index-status/<md5>')
+def index_status(md5):
+    """
+    Get the progress of the background indexing job of a share.
+
+    Args:
+        md5 (str): MD5 hash of the share
+
+    Returns:
+        JSON response with job status and number of indexed files or error message
+    """
+    if not session.get('admin_logged_in'):
+        return {'success': False, 'error': 'not authorized'}, 401
+
+    job = get_index_job(current_app, md5)
+    if job is None:
+        return {'success': False, 'error': 'no indexing job'}, 404
+
+    return {
+        'success': True,
+        'status': job['status'],
+        'files_indexed': job['files_indexed'],
+        'error': job['error']
+    }
+
+
+@admin_bp.route('/admin/search')
+def admin_search():
+    """
+    Search indexed files of all shares by name, folder, type and capture date.
+    Matches come from the full-text index, best first; pass the returned
+    "next" offset as the offset argument to get the following page.
+    Only the SEARCH_RANK_WINDOW most recently indexed matches are ranked: when a
+    search has more matches, even an exact name match among older files is
+    listed after them, newest first.
+
+    Query args:
+        q (str): Search text; every word must match the start of a word
+        limit (int): Page size
+        offset (int): Number of matches to skip
+
+    Returns:
+        JSON response with matching files: share MD5, file MD5, path, mimetype and capture time
+    """
+    if not session.get('admin_logged_in'):
+        return {'success': False, 'error': 'not authorized'}, 401
+
+    files, next_offset = search(current_app, request.args.get('q', ''), None,
+                                request.args.get('limit', type=int), request.args.get('offset', 0, type=int))
+    results = [{
+        'share': file['sharemd5'],
+        'md5': file['md5'],
+        'path': file['path'],
+        'mimetype': file['mimetype'],
+        'taken_at': file['taken_at'],
+        'url': url_for('guest.share_file', md5_share=file['sharemd5'], md5_file=file['md5'])
+    } for file in files]
+    return {'success': True, 'results': results, 'next': next_offset}
+
+
+@admin_bp.route('/admin/cache-stats')
+def admin_cache_stats():
+    """
+    Get hit and miss counters of the share and file lookup cache and the page cache of this process.
+
+    Returns:
+        JSON response with cache counters
+    """
+    if not session.get('admin_logged_in'):
+        return {'success': False, 'error': 'not authorized'}, 401
+
+    return {'success': True, **cache_stats(current_app), 'pages': page_cache_stats(current_app)}
+
+
+@admin_bp.route('/metrics')
+def metrics():
+    """
+    Expose request, database and cache metrics of this process in the Prometheus text format.
+    Requires an admin session, or the METRICS_TOKEN bearer token for scrapers.
+
+    Returns:
+        Plain text metrics response
+    """
+    token = current_app.config['METRICS_TOKEN']
+    authorized = session.get('admin_logged_in') or (
+        token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'))
+    if not authorized:
+        return {'success': False, 'error': 'not authorized'}, 401
+
+    body = render_metrics({'lookup': cache_stats(current_app), 'dirs': dir_cache_stats(),
+                           'pages': page_cache_stats(current_app)})
+    return current_app.response_class(body, mimetype='text/plain; version=0.0.4')
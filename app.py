@@ -1,12 +1,16 @@
-from flask import Flask, g, request, render_template, redirect, url_for, session, make_response
+from flask import Flask, g, request, redirect, url_for, session, make_response
+from flask_compress import Compress
 import os
 from config import config
 
-from helpers import get_locale, _, SUPPORTED_LANGS, DEFAULT_LANG
+from helpers import get_locale, translator, SUPPORTED_LANGS, DEFAULT_LANG
 from admin import admin_bp
 from guest import guest_bp
 from cli import register_cli_commands
-from scripts.db import check_admin_exists
+from scripts.db import check_admin_exists, migrate_db, release_db
+from scripts.metrics import init_metrics
+from scripts.assets import init_assets
+from scripts.pages import init_pages, render_page
 
 def create_app(config_name='default'):
     """
@@ -21,16 +25,27 @@ def create_app(config_name='default'):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
 
+    # Request latency, database and cache metrics, and the slow request profiler
+    init_metrics(app)
+
+    # Vendored front-end libraries, and compression of HTML and JSON responses
+    init_assets(app)
+    Compress(app)
+
+    # Rendered pages and fragments cached per template, language and data version
+    init_pages(app)
+
     # Make translation function available in all templates
     @app.context_processor
     def inject_translator():
         """
         Inject translation functions into template context.
+        The language is read once per render and bound to its compiled translation table.
 
         Returns:
             dict: Dictionary with translation functions
         """
-        return {'_': _, 'get_locale': get_locale}
+        return {'_': translator(get_locale()), 'get_locale': get_locale}
 
     @app.route('/set-lang/<lang>')
     def set_lang(lang):
@@ -52,13 +67,13 @@ def create_app(config_name='default'):
     @app.teardown_appcontext
     def close_db(error):
         """
-        Close database connection when application context tears down.
+        Return database connection to the pool when application context tears down.
 
         Args:
             error: Any error that occurred during request processing
         """
         if 'db' in g:
-            g.db.close()
+            release_db(app, g.pop('db'))
 
 
 
@@ -73,7 +88,7 @@ def create_app(config_name='default'):
         """
         admin_exists = check_admin_exists(app)
         if not admin_exists:
-            return render_template('index.html')
+            return render_page('index.html')
         if not session.get('admin_logged_in'):
             return redirect(url_for('admin.login'))
         return redirect(url_for('admin.admin_folders'))
@@ -85,6 +100,10 @@ def create_app(config_name='default'):
     # Register CLI commands
     register_cli_commands(app)
 
+    # Bring databases created by older versions up to date
+    with app.app_context():
+        migrate_db(app)
+
     return app
 
 # Создаем приложение с нужной конфигурацией
@@ -1,15 +1,20 @@
 """
 CLI commands module for homeCloud application.
-Contains Flask CLI commands for database initialization and testing.
+Contains Flask CLI commands for database initialization, testing and share indexing.
 """
 
 import os
+import json
 import click
 from flask import current_app
 from flask.cli import with_appcontext
 
-from scripts.db import add_file, add_share, init_db
-from scripts.mimetypes import getmimeType
+from scripts.db import add_share, init_db, migrate_db, get_all_shares, get_share
+from scripts.indexer import index_share
+from scripts.fingerprint import fingerprint_share
+from scripts.watcher import watch_shares
+from scripts.bench import run_benchmarks
+from scripts.assets import build_assets, hash_assets
 from helpers import calculate_md5
 
 
@@ -24,26 +29,121 @@ def db_init():
     click.echo('Initialized the database.')
 
 
+@click.command()
+@with_appcontext
+def db_migrate():
+    """
+    Apply pending schema migrations to an existing database.
+    """
+    applied = migrate_db(current_app)
+    click.echo(f'Applied {applied} migration(s).')
+
+
 @click.command()
 @with_appcontext
 def db_testfill():
     """
     Fill the database with test data from the testshare folder.
-    Creates a test share and adds all files from the data/testshare directory.
+    Creates a test share and indexes all files from the testshare directory of UPLOAD_FOLDER.
     """
-    folder_path = "data\\testshare"
+    folder_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'testshare')
     share_md5 = calculate_md5(folder_path)
     add_share(current_app, share_md5, folder_path)
+    added, _removed = index_share(current_app, share_md5, folder_path)
     
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            absolute_path = os.path.join(root, file)
-            md5_path = calculate_md5(absolute_path)
-            extension = absolute_path.split('.')[-1]
-            mimeType = getmimeType(extension)
-            add_file(current_app, share_md5, md5_path, absolute_path, mimeType)
-    
-    click.echo(f'Test share created: {share_md5}')
+    click.echo(f'Test share created: {share_md5} ({added} files)')
+
+
+@click.command()
+@click.option('--share', 'share_md5', default=None, help='MD5 hash of a single share to re-index.')
+@click.option('--recheck', is_flag=True, help='Stat every indexed file to find files changed in place.')
+@with_appcontext
+def reindex(share_md5, recheck):
+    """
+    Incrementally re-index shares.
+    Only directories whose mtime or inode changed since the last run are rescanned.
+    """
+    shares = [get_share(current_app, share_md5)] if share_md5 else get_all_shares(current_app)
+    for share in shares:
+        if share is None:
+            raise click.ClickException(f'Share not found: {share_md5}')
+        added, removed = index_share(current_app, share['md5'], share['path'], recheck=recheck)
+        click.echo(f"{share['md5']}: {added} files added, {removed} removed")
+
+
+@click.command()
+@click.option('--share', 'share_md5', default=None, help='MD5 hash of a single share to fingerprint.')
+@click.option('--recheck', is_flag=True, help='Hash again files whose size or mtime changed.')
+@with_appcontext
+def fingerprint(share_md5, recheck):
+    """
+    Compute content fingerprints of indexed files.
+    Only files without a fingerprint are hashed, plus changed files with --recheck.
+    """
+    shares = [get_share(current_app, share_md5)] if share_md5 else get_all_shares(current_app)
+    for share in shares:
+        if share is None:
+            raise click.ClickException(f'Share not found: {share_md5}')
+        done = fingerprint_share(current_app, share['md5'], recheck)
+        click.echo(f"{share['md5']}: {done} files fingerprinted")
+
+
+@click.command()
+@click.option('--interval', default=None, type=int, help='Seconds between polling passes.')
+@with_appcontext
+def watch(interval):
+    """
+    Watch shared folders and apply file changes to the database.
+    Uses inotify when available, polling otherwise.
+    """
+    watch_shares(current_app, interval or current_app.config['WATCHER_INTERVAL'])
+
+
+@click.command()
+@click.option('--scale', default=1, type=int, help='Multiplier for the synthetic dataset sizes.')
+@click.option('--requests', 'requests_count', default=200, type=int, help='Requests per endpoint.')
+@click.option('--concurrency', default=4, type=int, help='Concurrent clients per endpoint.')
+@click.option('--output', default=None, type=click.Path(dir_okay=False), help='Write the JSON results to a file.')
+@click.option('--keep', is_flag=True, help='Keep the temporary upload folder and database.')
+def bench(scale, requests_count, concurrency, output, keep):
+    """
+    Benchmark hot endpoints and indexing on synthetic datasets.
+    Runs against a temporary UPLOAD_FOLDER and database and prints p50/p95/p99
+    latencies and files/sec as JSON, so runs can be compared.
+    """
+    # Imported here, app imports this module
+    from app import create_app
+
+    results = run_benchmarks(create_app, scale, requests_count, concurrency, keep)
+    report = json.dumps(results, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    click.echo(report)
+
+
+@click.command()
+@click.option('--source', default=None, type=click.Path(exists=True, file_okay=False),
+              help='Folder with the library files as <package>/<path>, instead of downloading them.')
+@click.option('--print-hashes', is_flag=True,
+              help='Only print the sha256 of every file, to pin them in VENDOR_PACKAGES.')
+@with_appcontext
+def assets_build(source, print_hashes):
+    """
+    Vendor the front-end libraries into static/vendor.
+    Every file must match its pinned sha256. Files are stored in content-hashed
+    folders with gzip and brotli copies.
+    """
+    if print_hashes:
+        for name, digest in sorted(hash_assets(source).items()):
+            click.echo(f'{digest}  {name}')
+        return
+    try:
+        manifest = build_assets(current_app.static_folder, source)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for package, folder in sorted(manifest.items()):
+        click.echo(f'{package}: {folder}')
 
 
 def register_cli_commands(app):
@@ -54,4 +154,10 @@ def register_cli_commands(app):
         app: Flask application instance
     """
     app.cli.add_command(db_init, 'db_init')
+    app.cli.add_command(db_migrate, 'db_migrate')
     app.cli.add_command(db_testfill, 'db_testfill')
+    app.cli.add_command(bench, 'bench')
+    app.cli.add_command(assets_build, 'assets_build')
+    app.cli.add_command(reindex, 'reindex')
+    app.cli.add_command(fingerprint, 'fingerprint')
+    app.cli.add_command(watch, 'watch')
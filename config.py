@@ -16,6 +16,18 @@ class Config:
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{DATABASE}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # SQLite connection settings
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))  # idle connections kept per worker process
+    DB_TIMEOUT = float(os.getenv('DB_TIMEOUT', 10))  # seconds to wait for a locked database
+    DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))
+    DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', 10000))  # cached share and file lookups
+    DB_CACHE_TTL = int(os.getenv('DB_CACHE_TTL', 30))  # seconds, bounds staleness across processes
+    DB_CACHED_STATEMENTS = int(os.getenv('DB_CACHED_STATEMENTS', 256))
+
+    # Rendered page and fragment cache
+    PAGE_CACHE_SIZE = int(os.getenv('PAGE_CACHE_SIZE', 1000))
+    PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 300))  # seconds, bounds staleness across processes
+
     # Security settings
     SESSION_COOKIE_SECURE = True
     SESSION_COOKIE_HTTPONLY = True
@@ -25,6 +37,71 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'data')
 
+    # File delivery settings
+    SEND_FILE_MAX_AGE = int(os.getenv('SEND_FILE_MAX_AGE', 24 * 3600))  # seconds
+    # Reverse proxy offload: empty, 'x-accel' (nginx) or 'x-sendfile' (Apache, lighttpd)
+    SENDFILE_BACKEND = os.getenv('SENDFILE_BACKEND', '')
+    USE_X_SENDFILE = SENDFILE_BACKEND == 'x-sendfile'
+    # nginx internal location that maps to UPLOAD_FOLDER, used with 'x-accel'
+    X_ACCEL_PREFIX = os.getenv('X_ACCEL_PREFIX', '/protected/')
+
+    # Dynamic compression of pages and JSON; vendored assets are served precompressed
+    COMPRESS_MIMETYPES = ['text/html', 'application/json']
+    COMPRESS_ALGORITHM = ['br', 'gzip']
+    COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))
+    COMPRESS_BR_LEVEL = int(os.getenv('COMPRESS_BR_LEVEL', 4))
+    COMPRESS_MIN_SIZE = 500  # bytes
+    # Streamed responses (share listings) are sent as they are produced, not buffered to compress
+    COMPRESS_STREAMS = False
+    # Request metrics and profiling
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    # Bearer token for scraping /metrics without an admin session; empty to require a session
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    PROFILE_SLOW_MS = int(os.getenv('PROFILE_SLOW_MS', 0))  # 0 disables profiling
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.1))  # share of requests profiled
+    PROFILE_FOLDER = os.getenv('PROFILE_FOLDER', 'cache/profiles')
+
+    # Native threads for blocking work (archives, track parsing) under gevent workers
+    BLOCKING_POOL_SIZE = int(os.getenv('BLOCKING_POOL_SIZE', 16))
+
+    # Background indexing settings
+    INDEXER_WORKERS = int(os.getenv('INDEXER_WORKERS', 2))
+    SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', 8))  # concurrent scandir and stat calls
+    # Files rewritten in place keep their directory's mtime; cached sizes are re-read after this long
+    SCAN_CACHE_TTL = int(os.getenv('SCAN_CACHE_TTL', 300))  # seconds
+    INDEXER_BATCH_SIZE = int(os.getenv('INDEXER_BATCH_SIZE', 5000))
+    METADATA_WORKERS = int(os.getenv('METADATA_WORKERS', os.cpu_count() or 1))  # EXIF, ffprobe and GPX readers
+    WATCHER_INTERVAL = int(os.getenv('WATCHER_INTERVAL', 60))  # seconds
+    WATCHER_RECHECK_INTERVAL = int(os.getenv('WATCHER_RECHECK_INTERVAL', 24 * 3600))  # seconds between stat sweeps of all files when polling
+    # Content fingerprints after indexing, so duplicates share thumbnails, transcodes and ETags
+    FINGERPRINT_ENABLED = os.getenv('FINGERPRINT_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+    # Thumbnail settings
+    THUMBNAIL_FOLDER = os.getenv('THUMBNAIL_FOLDER', 'cache/thumbnails')
+    THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))
+    THUMBNAIL_TIMEOUT = int(os.getenv('THUMBNAIL_TIMEOUT', 60))  # seconds
+    THUMBNAIL_MAX_AGE = int(os.getenv('THUMBNAIL_MAX_AGE', 7 * 24 * 3600))  # seconds
+    PREFETCH_COUNT = int(os.getenv('PREFETCH_COUNT', 3))  # viewer items preloaded on each side
+    FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+
+    # Display-size image renditions
+    RENDITION_CACHE_FOLDER = os.getenv('RENDITION_CACHE_FOLDER', 'cache/renditions')
+    RENDITION_CACHE_MAX_BYTES = int(os.getenv('RENDITION_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+    RENDITION_WORKERS = int(os.getenv('RENDITION_WORKERS', 2))
+    RENDITION_TIMEOUT = int(os.getenv('RENDITION_TIMEOUT', 60))  # seconds
+
+    # Simplified GPX track cache
+    TRACK_CACHE_FOLDER = os.getenv('TRACK_CACHE_FOLDER', 'cache/tracks')
+
+    # On-demand HLS video streaming
+    HLS_ENABLED = os.getenv('HLS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    HLS_CACHE_FOLDER = os.getenv('HLS_CACHE_FOLDER', 'cache/hls')
+    HLS_CACHE_MAX_BYTES = int(os.getenv('HLS_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+    HLS_SEGMENT_SECONDS = int(os.getenv('HLS_SEGMENT_SECONDS', 4))
+    HLS_MAX_JOBS = int(os.getenv('HLS_MAX_JOBS', 2))
+    HLS_TRANSCODE_TIMEOUT = int(os.getenv('HLS_TRANSCODE_TIMEOUT', 60))  # seconds
+    FFPROBE_BINARY = os.getenv('FFPROBE_BINARY', 'ffprobe')
+
 
 class DevelopmentConfig(Config):
     """Development environment configuration."""
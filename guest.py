@@ -3,20 +3,175 @@ Guest routes module for homeCloud application.
 Contains public routes for file sharing and viewing without authentication.
 """
 
+import os
 import json
-from flask import Blueprint, render_template, current_app
+import xml.etree.ElementTree as ET
+from urllib.parse import quote
+from flask import Blueprint, current_app, request, abort, redirect, url_for, send_file, stream_with_context, Response
 
-from scripts.db import get_share_file, get_share_files
+from scripts.db import get_share as get_share_record, get_share_file, get_share_version, iter_share_media, list_dir_files, get_neighbour_files
+from scripts.archive import stream_zip
+from scripts.concurrency import run_blocking, iter_blocking
+from scripts.fingerprint import current_fingerprint
+from scripts.gpx import get_track
+from scripts.hls import probe, available_rungs, master_playlist, media_playlist, get_segment
+from scripts.metrics import record_handler
 from scripts.mimetypes import getFileByMimetype
+from scripts.pages import render_page, cached_fragment
+from scripts.renditions import RENDITION_SKIPPED_TYPES, choose_format, choose_size, get_rendition
+from scripts.search import search
+from scripts.thumbnails import THUMBNAIL_SIZES, THUMBNAIL_MIMETYPES, THUMBNAIL_PLACEHOLDERS, get_thumbnail
+from helpers import calculate_md5, etag_matches, resolve_upload_path
+
+# Maximum number of files per page of a share listing
+SHARE_PAGE_SIZE_MAX = 5000
+
+# Cache lifetime of thumbnail and rendition URLs carrying the current version token
+VERSIONED_MAX_AGE = 365 * 24 * 3600
+
+# Client hints the display renditions are sized from
+VIEWPORT_HINTS = ('Sec-CH-Viewport-Width', 'Sec-CH-DPR')
+
+# MIME types that are already compressed and stored without compression in archives
+ARCHIVE_STORED_MIMETYPES = ('image', 'video')
 
 # Create blueprint for guest routes
 guest_bp = Blueprint('guest', __name__)
 
 
+def _version_token(file):
+    """
+    Get the version token of the URLs derived from a file.
+    The content fingerprint is used when known, otherwise the indexed mtime;
+    both change whenever the indexer sees the file change.
+
+    Args:
+        file (sqlite3.Row): File record
+
+    Returns:
+        str or None: Version token, or None if the file was indexed without its mtime
+    """
+    if file['fingerprint'] is not None:
+        return file['fingerprint'].rsplit(':', 1)[-1][:16]
+    if file['mtime_ns'] is not None:
+        return f'{file["mtime_ns"]:x}'
+    return None
+
+
+def _versioned(url, file):
+    """
+    Append the version token of a file to a URL.
+
+    Args:
+        url (str): URL without query string
+        file (sqlite3.Row): File record
+
+    Returns:
+        str: URL with a v query argument when the file has a version token
+    """
+    token = _version_token(file)
+    return url if token is None else f'{url}?v={token}'
+
+
+def _is_immutable(file):
+    """
+    Check whether a response derived from a file can be cached as immutable.
+    The request must carry the file's current version token, and the indexed size
+    and mtime must still match the file: a file edited since it was indexed would
+    otherwise pin its new content under the old version's URL.
+
+    Args:
+        file (sqlite3.Row): File record
+
+    Returns:
+        bool: True if the response may be cached as immutable
+    """
+    token = request.args.get('v')
+    if token is None or token != _version_token(file):
+        return False
+    try:
+        st = os.stat(file['path'])
+    except OSError:
+        return False
+    return (file['size'], file['mtime_ns']) == (st.st_size, st.st_mtime_ns)
+
+
+def _thumb_url(md5_share, file, size='large'):
+    """
+    Build the thumbnail URL of a file.
+    Files carry a version token, so the URL can be cached as immutable.
+
+    Args:
+        md5_share (str): MD5 hash of the share
+        file (sqlite3.Row): File record
+        size (str): Thumbnail size name
+
+    Returns:
+        str or None: Thumbnail URL, or None for files without thumbnails
+    """
+    if file['mimetype'] not in THUMBNAIL_MIMETYPES:
+        return None
+    return _versioned(f'{request.script_root}/share/{md5_share}/{file["md5"]}/thumb/{size}', file)
+
+
+def _rendition_url(md5_share, file):
+    """
+    Build the display rendition URL of an image, versioned like thumbnail URLs.
+
+    Args:
+        md5_share (str): MD5 hash of the share
+        file (sqlite3.Row): File record
+
+    Returns:
+        str: Rendition URL
+    """
+    return _versioned(f'{request.script_root}/share/{md5_share}/{file["md5"]}/display', file)
+
+
+def _viewport_edge():
+    """
+    Get the long edge of the client's viewport in device pixels.
+    The w query argument, set by the viewer from the screen size, takes precedence
+    over the viewport width and pixel ratio client hints.
+
+    Returns:
+        int or None: Edge in pixels, or None if the client gave no hint
+    """
+    edge = request.args.get('w', type=int)
+    if edge is not None:
+        return edge
+    try:
+        width = float(request.headers.get('Sec-CH-Viewport-Width') or request.headers['Viewport-Width'])
+        dpr = float(request.headers.get('Sec-CH-DPR') or request.headers.get('DPR') or 1)
+    except (KeyError, ValueError):
+        return None
+    return int(width * dpr)
+
+
+def _preload_links(md5_share, files):
+    """
+    Build a Link header preloading the thumbnails of files.
+    The viewer fetches thumbnails with fetch(), so they are preloaded as fetch;
+    files without thumbnails are skipped.
+
+    Args:
+        md5_share (str): MD5 hash of the share
+        files (iterable): File records
+
+    Returns:
+        str: Link header value
+    """
+    urls = [_thumb_url(md5_share, file) for file in files]
+    return ', '.join(f'<{url}>; rel=preload; as=fetch; crossorigin' for url in urls if url is not None)
+
+
 @guest_bp.route('/share/<md5>')
 def get_share(md5):
     """
     Display the share view page for a given share MD5.
+    The page does not depend on the share and is served from the page cache;
+    the response preloads the thumbnails of the first files shown by the viewer,
+    cached per share index version.
     
     Args:
         md5 (str): MD5 hash of the share
@@ -24,7 +179,18 @@ def get_share(md5):
     Returns:
         Rendered template for share viewing
     """
-    return render_template('share_view.html')
+    prefetch_count = current_app.config['PREFETCH_COUNT']
+    response = render_page('share_view.html',
+                           hls_enabled=current_app.config['HLS_ENABLED'],
+                           prefetch_count=prefetch_count)
+    links = cached_fragment(
+        ('preload', md5, get_share_version(current_app, md5)),
+        lambda: _preload_links(md5, iter_share_media(current_app, md5, limit=prefetch_count + 1)))
+    if links:
+        response.headers['Link'] = links
+    # Ask for the viewport hints used to size display renditions
+    response.headers['Accept-CH'] = ', '.join(VIEWPORT_HINTS)
+    return response
 
 
 @guest_bp.route('/external-viewer/<mimetype>/<md5_share>/<md5_file>')
@@ -32,6 +198,8 @@ def get_external_viewer(mimetype, md5_share, md5_file):
     """
     Display external viewer for specific file types.
     Currently supports map viewer for maptrack files.
+    Unknown files, files of another type than the viewer and types without
+    a viewer are answered with 404 before any page is rendered or cached.
     
     Args:
         mimetype (str): MIME type identifier
@@ -39,44 +207,302 @@ def get_external_viewer(mimetype, md5_share, md5_file):
         md5_file (str): MD5 hash of the file
         
     Returns:
-        Rendered template for external viewer or None
+        Rendered template for external viewer
     """
+    file = get_share_file(current_app, md5_share, md5_file)
+    if file is None or file['mimetype'] != mimetype:
+        abort(404)
     if mimetype == "maptrack":
-        return render_template('external-viewers/map.html', 
-                             share_md5=md5_share, 
-                             file_md5=md5_file)
+        return render_page('external-viewers/map.html', (md5_share, md5_file),
+                           share_md5=md5_share,
+                           file_md5=md5_file)
+    if mimetype == "video":
+        return render_page('external-viewers/video.html', (md5_share, md5_file),
+                           share_md5=md5_share,
+                           file_md5=md5_file)
+    abort(404)
+
+
+def _get_hls_video(md5_share, md5_file):
+    """
+    Get a video file of a share and its probe info for HLS routes.
+    Aborts with 404 when HLS is disabled or the file is not a readable video.
+
+    Args:
+        md5_share (str): MD5 hash of the share
+        md5_file (str): MD5 hash of the file
+
+    Returns:
+        tuple: (file row, probe info dict)
+    """
+    if not current_app.config['HLS_ENABLED']:
+        abort(404)
+    file = get_share_file(current_app, md5_share, md5_file)
+    if file is None or file['mimetype'] != 'video':
+        abort(404)
+    try:
+        info = probe(current_app, file['path'])
+    except Exception as e:
+        current_app.logger.warning('Video probe failed for %s: %s', file['path'], e)
+        abort(404)
+    return file, info
+
+
+@guest_bp.route('/share/hls/<md5_share>/<md5_file>/master.m3u8')
+def hls_master_playlist(md5_share, md5_file):
+    """
+    Serve the HLS master playlist of a video with one variant per bitrate rung.
+
+    Args:
+        md5_share (str): MD5 hash of the share
+        md5_file (str): MD5 hash of the file
+
+    Returns:
+        HLS master playlist response
+    """
+    _file, info = _get_hls_video(md5_share, md5_file)
+    return Response(master_playlist(info), mimetype='application/vnd.apple.mpegurl')
+
+
+@guest_bp.route('/share/hls/<md5_share>/<md5_file>/<rung>/index.m3u8')
+def hls_media_playlist(md5_share, md5_file, rung):
+    """
+    Serve the HLS media playlist of a video for one bitrate rung.
+
+    Args:
+        md5_share (str): MD5 hash of the share
+        md5_file (str): MD5 hash of the file
+        rung (str): Ladder rung name
+
+    Returns:
+        HLS media playlist response
+    """
+    _file, info = _get_hls_video(md5_share, md5_file)
+    if rung not in available_rungs(info):
+        abort(404)
+    return Response(media_playlist(current_app, info), mimetype='application/vnd.apple.mpegurl')
+
+
+@guest_bp.route('/share/hls/<md5_share>/<md5_file>/<rung>/<int:index>.ts')
+def hls_segment(md5_share, md5_file, rung, index):
+    """
+    Serve one HLS segment, transcoding it on first request.
+
+    Args:
+        md5_share (str): MD5 hash of the share
+        md5_file (str): MD5 hash of the file
+        rung (str): Ladder rung name
+        index (int): Segment number
+
+    Returns:
+        MPEG-TS segment response, or 503 when all transcode slots are busy
+    """
+    file, info = _get_hls_video(md5_share, md5_file)
+    if rung not in available_rungs(info) or index * current_app.config['HLS_SEGMENT_SECONDS'] >= info['duration']:
+        abort(404)
+    try:
+        segment = get_segment(current_app, md5_file, file['path'], rung, index, current_fingerprint(file))
+    except Exception as e:
+        current_app.logger.warning('HLS transcode failed for %s: %s', file['path'], e)
+        abort(500)
+    if segment is None:
+        response = Response(status=503)
+        response.headers['Retry-After'] = '1'
+        return response
+    return send_file(segment, mimetype='video/mp2t', max_age=current_app.config['SEND_FILE_MAX_AGE'])
+
+
+@guest_bp.route('/share/track/<md5_share>/<md5_file>')
+def get_share_track(md5_share, md5_file):
+    """
+    Get a GPX track simplified for a map zoom level as JSON data.
+    Tracks are parsed and simplified once for all zoom levels and then served from cache.
+    The URL carries no version, so responses are revalidated with an ETag of the content.
+    
+    Args:
+        md5_share (str): MD5 hash of the share
+        md5_file (str): MD5 hash of the file
+        
+    Query args:
+        zoom (int): Current map zoom level
+        
+    Returns:
+        JSON response with bounds, available levels and an encoded polyline
+    """
+    file = get_share_file(current_app, md5_share, md5_file)
+    if file is None or file['mimetype'] != 'maptrack':
+        abort(404)
+
+    try:
+        track = run_blocking(current_app, get_track, current_app._get_current_object(), md5_file, file['path'],
+                             request.args.get('zoom', 12, type=int), current_fingerprint(file))
+    except (OSError, ValueError, TypeError, ET.ParseError) as e:
+        current_app.logger.warning('Track simplification failed for %s: %s', file['path'], e)
+        abort(404)
+
+    body = json.dumps(track)
+    etag = calculate_md5(body)
+    if etag_matches(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 
 @guest_bp.route('/share/all/<md5_share>')
 def get_all_from_share(md5_share):
     """
-    Get all files from a share as JSON data.
-    Returns a list of all files in the share with their metadata.
+    Get files from a share as JSON data, ordered by capture time.
+    The list is streamed while it is read from the index. With the limit
+    query argument it is paginated: pass the returned "next" cursor as the after
+    argument to get the following page. Responses carry an ETag derived from
+    the share's index version, so unchanged listings are answered with 304.
     
     Args:
         md5_share (str): MD5 hash of the share
         
     Returns:
-        JSON response containing list of files with MD5 and mimetype
+        JSON response containing list of files with MD5, mimetype, capture time,
+        display rendition URL of images and the preload hints of the viewer:
+        thumbnail URL, size in bytes and image dimensions
     """
-    data = {}
-    data["mediaList"] = []
-    files = get_share_files(current_app, md5_share)
-    
-    for file in files:
-        fileData = {}
-        fileData["md5"] = file['md5']
-        fileData["mimetype"] = file['mimetype']
-        data["mediaList"].append(fileData)
+    version = get_share_version(current_app, md5_share)
+    if version is None:
+        abort(404)
+
+    after = request.args.get('after')
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, SHARE_PAGE_SIZE_MAX))
+
+    etag = calculate_md5(f'{md5_share}:{version}:{after}:{limit}')
+    if etag_matches(etag):
+        response = current_app.response_class(status=304)
+    else:
+        # One extra row tells whether another page follows
+        files = iter_share_media(current_app, md5_share, after, None if limit is None else limit + 1)
+
+        def generate():
+            yield '{"mediaList": ['
+            next_key = None
+            for count, file in enumerate(files):
+                if count == limit:
+                    next_key = last_key
+                    break
+                fileData = {}
+                fileData["md5"] = file['md5']
+                fileData["mimetype"] = file['mimetype']
+                fileData["thumb"] = _thumb_url(md5_share, file)
+                if file['mimetype'] == 'image' and file['content_type'] not in RENDITION_SKIPPED_TYPES:
+                    fileData["display"] = _rendition_url(md5_share, file)
+                fileData["size"] = file['size']
+                fileData["width"] = file['width']
+                fileData["height"] = file['height']
+                fileData["taken_at"] = file['taken_at']
+                yield (', ' if count else '') + json.dumps(fileData)
+                last_key = file['sort_key']
+            yield '], "next": ' + json.dumps(next_key) + '}'
+
+        response = current_app.response_class(stream_with_context(generate()), mimetype='application/json')
+
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
+@guest_bp.route('/share/search/<md5_share>')
+def search_share(md5_share):
+    """
+    Search files of a share by name, folder, type and capture date.
+    Matches come from the full-text index, best first; pass the returned
+    "next" offset as the offset argument to get the following page.
+    Only the SEARCH_RANK_WINDOW most recently indexed matches are ranked: when a
+    search has more matches, even an exact name match among older files is
+    listed after them, newest first.
+
+    Args:
+        md5_share (str): MD5 hash of the share
+
+    Query args:
+        q (str): Search text; every word must match the start of a word
+        limit (int): Page size
+        offset (int): Number of matches to skip
+
+    Returns:
+        JSON response containing matching files with MD5, name, path relative
+        to the share, mimetype, capture time and thumbnail URL
+    """
+    share = get_share_record(current_app, md5_share)
+    if share is None:
+        abort(404)
+
+    files, next_offset = search(current_app, request.args.get('q', ''), md5_share,
+                                request.args.get('limit', type=int), request.args.get('offset', 0, type=int))
+    results = [{
+        'md5': file['md5'],
+        'name': os.path.basename(file['path']),
+        'path': os.path.relpath(file['path'], share['path']),
+        'mimetype': file['mimetype'],
+        'taken_at': file['taken_at'],
+        'thumb': _thumb_url(md5_share, file, 'small')
+    } for file in files]
+    return {'results': results, 'next': next_offset}
+
+
+@guest_bp.route('/share/download/<md5_share>')
+def download_share(md5_share):
+    """
+    Download a whole share, or one of its subfolders, as a ZIP archive.
+    The archive is streamed while the files table is walked: nothing is
+    buffered on disk or in memory, and already compressed media is stored as is.
+    Reading and compressing run on the blocking pool, so gevent workers keep serving.
     
-    return json.dumps(data)
+    Args:
+        md5_share (str): MD5 hash of the share
+        
+    Query args:
+        path (str): Optional subfolder path relative to the share
+        
+    Returns:
+        Streamed ZIP64 archive response
+    """
+    share = get_share_record(current_app, md5_share)
+    if share is None:
+        abort(404)
+    rel_path = request.args.get('path', '')
+    if resolve_upload_path(share['path'], rel_path) is None:
+        abort(404)
+    # Indexed paths extend the share path as stored, so only the relative part is normalised
+    folder = share['path'].rstrip(os.sep) or os.sep
+    if os.path.normpath(rel_path or '.') != '.':
+        folder = os.path.join(folder, os.path.normpath(rel_path))
+
+    def members():
+        after = None
+        while True:
+            files = list_dir_files(current_app, md5_share, folder, after)
+            if not files:
+                return
+            for file in files:
+                arcname = os.path.relpath(file['path'], folder)
+                yield arcname, file['path'], file['mimetype'] not in ARCHIVE_STORED_MIMETYPES
+            after = files[-1]['path']
+
+    filename = (os.path.basename(folder) or md5_share) + '.zip'
+    archive = iter_blocking(current_app, stream_zip(members()))
+    response = current_app.response_class(stream_with_context(archive), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    return response
 
 
 @guest_bp.route('/share/<md5_share>/<md5_file>')
 def share_file(md5_share, md5_file):
     """
     Serve a specific file from a share.
-    Retrieves and serves the file based on its MIME type.
+    Retrieves and serves the file based on its MIME type. Only URLs carrying
+    the file's current version token are cached as immutable.
     
     Args:
         md5_share (str): MD5 hash of the share
@@ -86,6 +512,91 @@ def share_file(md5_share, md5_file):
         File response based on MIME type
     """
     file = get_share_file(current_app, md5_share, md5_file)
+    if file is None:
+        abort(404)
     mimetype = file['mimetype']
     filepath = file['path']
-    return getFileByMimetype(mimetype, filepath)
+    return getFileByMimetype(mimetype, filepath, file['content_type'], current_fingerprint(file),
+                             _is_immutable(file))
+
+
+@guest_bp.route('/share/<md5_share>/<md5_file>/display')
+def share_file_display(md5_share, md5_file):
+    """
+    Serve an image of a share resized for the client's screen.
+    The size is chosen from the w query argument or the viewport client hints,
+    and the format from the Accept header: AVIF, WebP or JPEG. Renditions are
+    generated on first request and served from the disk cache afterwards;
+    animated images, and images that cannot be rendered, are served as they are.
+    Like thumbnails, URLs carrying the file's current version token are cached as immutable.
+
+    Args:
+        md5_share (str): MD5 hash of the share
+        md5_file (str): MD5 hash of the file
+
+    Returns:
+        Image response
+    """
+    file = get_share_file(current_app, md5_share, md5_file)
+    if file is None:
+        abort(404)
+    if file['mimetype'] != 'image' or file['content_type'] in RENDITION_SKIPPED_TYPES:
+        return getFileByMimetype(file['mimetype'], file['path'], file['content_type'], current_fingerprint(file),
+                                 _is_immutable(file))
+
+    content_type = choose_format(request.accept_mimetypes)
+    rendition = get_rendition(current_app, md5_file, file['path'], choose_size(_viewport_edge()),
+                              content_type, current_fingerprint(file))
+    if rendition is None:
+        return getFileByMimetype(file['mimetype'], file['path'], file['content_type'], current_fingerprint(file),
+                                 _is_immutable(file))
+
+    record_handler('rendition')
+    immutable = _is_immutable(file)
+    response = send_file(rendition, mimetype=content_type,
+                         max_age=VERSIONED_MAX_AGE if immutable else current_app.config['THUMBNAIL_MAX_AGE'])
+    if immutable:
+        response.cache_control.immutable = True
+    response.vary.add('Accept')
+    if 'w' not in request.args:
+        response.vary.update(VIEWPORT_HINTS)
+    return response
+
+
+@guest_bp.route('/share/<md5_share>/<md5_file>/thumb/<size>')
+def share_file_thumbnail(md5_share, md5_file, size):
+    """
+    Serve a thumbnail of a specific file from a share.
+    Thumbnails are generated on first request and served from the disk cache afterwards.
+    Large thumbnails carry a Link header preloading the neighbouring ones in the
+    viewer order, and URLs carrying the file's current version token are cached as immutable.
+    
+    Args:
+        md5_share (str): MD5 hash of the share
+        md5_file (str): MD5 hash of the file
+        size (str): Thumbnail size name (small, medium or large)
+        
+    Returns:
+        JPEG thumbnail response or redirect to a placeholder image
+    """
+    file = get_share_file(current_app, md5_share, md5_file)
+    if file is None or size not in THUMBNAIL_SIZES:
+        abort(404)
+
+    thumbnail = get_thumbnail(current_app, file['mimetype'], file['path'], md5_file, size, current_fingerprint(file))
+    if thumbnail is None:
+        if file['mimetype'] in THUMBNAIL_PLACEHOLDERS:
+            return redirect(url_for('static', filename=THUMBNAIL_PLACEHOLDERS[file['mimetype']]))
+        abort(404)
+    immutable = _is_immutable(file)
+    response = send_file(thumbnail, mimetype='image/jpeg',
+                         max_age=VERSIONED_MAX_AGE if immutable else current_app.config['THUMBNAIL_MAX_AGE'])
+    if immutable:
+        response.cache_control.immutable = True
+    if size == 'large':
+        previous, following = get_neighbour_files(current_app, md5_share, file['sort_key'] or '',
+                                                  current_app.config['PREFETCH_COUNT'])
+        links = _preload_links(md5_share, following + previous)
+        if links:
+            response.headers['Link'] = links
+    return response
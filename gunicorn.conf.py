@@ -0,0 +1,18 @@
+"""
+Gunicorn configuration for homeCloud application.
+Uses gevent workers by default, so slow downloads and video streams only hold
+a greenlet each instead of a whole worker process.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+# Concurrent connections per gevent worker
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# The application must be imported after gevent has patched the worker
+preload_app = False
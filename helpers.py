@@ -6,7 +6,9 @@ Contains localization functions, utility methods, and common helpers.
 import json
 import hashlib
 import os
-from flask import session
+from flask import session, request
+
+from scripts import scanner
 
 # --- Localization ---
 with open('locales.json', encoding='utf-8') as f:
@@ -15,6 +17,19 @@ SUPPORTED_LANGS = ['en', 'ru']
 DEFAULT_LANG = 'en'
 
 
+class _Catalog(dict):
+    """
+    Translation table of one language; missing keys translate to themselves.
+    """
+
+    def __missing__(self, key):
+        return key
+
+
+# Compiled translation tables: language -> catalog, looked up with a single dict access
+CATALOGS = {lang: _Catalog(LOCALES.get(lang, {})) for lang in SUPPORTED_LANGS}
+
+
 def get_locale():
     """
     Get the current user's locale from session.
@@ -39,8 +54,36 @@ def _(key):
     Returns:
         str: Translated string or the key itself if translation not found
     """
-    lang = get_locale()
-    return LOCALES.get(lang, {}).get(key, key)
+    return CATALOGS[get_locale()][key]
+
+
+def translator(lang):
+    """
+    Get the translation function of a language.
+    Templates get it once per render, so translating a string costs one dict lookup.
+
+    Args:
+        lang (str): Language code
+
+    Returns:
+        callable: Function translating a key, or returning the key itself if not found
+    """
+    return CATALOGS[lang].__getitem__
+
+
+def etag_matches(etag):
+    """
+    Check whether the request's If-None-Match holds an ETag.
+    Compressed responses carry the ETag with the encoding appended ("etag:gzip").
+
+    Args:
+        etag (str): Unquoted ETag of the uncompressed response
+
+    Returns:
+        bool: True if the client has the response cached
+    """
+    return any(candidate in request.if_none_match
+               for candidate in (etag, f'{etag}:br', f'{etag}:gzip', f'{etag}:deflate'))
 
 
 def calculate_md5(path):
@@ -62,6 +105,7 @@ def calculate_md5(path):
 def get_folder_size(path):
     """
     Calculate the total size of a folder recursively.
+    Delegates to the folder scanner, so unchanged directories are not walked again.
     
     Args:
         path (str): Path to the folder
@@ -69,16 +113,26 @@ def get_folder_size(path):
     Returns:
         int: Total size in bytes
     """
-    total_size = 0
-    try:
-        for entry in os.scandir(path):
-            if entry.is_file():
-                total_size += entry.stat().st_size
-            elif entry.is_dir():
-                total_size += get_folder_size(entry.path)
-    except PermissionError:
-        pass
-    return total_size
+    return scanner.get_folder_size(path)
+
+
+def resolve_upload_path(root, rel_path):
+    """
+    Resolve a path relative to the upload folder.
+    Paths escaping the upload folder are rejected.
+    
+    Args:
+        root (str): Upload folder path
+        rel_path (str): Path relative to the upload folder ('' for the root itself)
+        
+    Returns:
+        str or None: Joined absolute path or None if it points outside the upload folder
+    """
+    abs_path = os.path.join(root, rel_path) if rel_path else root
+    real_root = os.path.realpath(root)
+    if os.path.commonpath([real_root, os.path.realpath(abs_path)]) != real_root:
+        return None
+    return abs_path
 
 
 def format_size(size):
@@ -2,21 +2,74 @@
 -- Drop existing tables if they exist
 DROP TABLE IF EXISTS shares;
 DROP TABLE IF EXISTS files;
+DROP TABLE IF EXISTS files_fts;
 DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS index_jobs;
+DROP TABLE IF EXISTS dirs;
 
 -- Table for storing shared folders
 CREATE TABLE shares (
     md5 TEXT PRIMARY KEY,        -- MD5 hash of the folder path
-    path TEXT NOT NULL           -- File system path to the shared folder
+    path TEXT NOT NULL,          -- File system path to the shared folder
+    version INTEGER NOT NULL DEFAULT 0  -- Index version, increased whenever files change
 );
 
 -- Table for storing files within shares
 CREATE TABLE files (
+    id INTEGER PRIMARY KEY,      -- Stable row id, shared by the search index
     sharemd5 TEXT NOT NULL,      -- MD5 hash of the parent share
-    md5 TEXT PRIMARY KEY,        -- MD5 hash of the file path
+    md5 TEXT NOT NULL,           -- MD5 hash of the file path
     path TEXT NOT NULL,          -- File system path to the file
-    mimetype TEXT NOT NULL       -- MIME type of the file
+    mimetype TEXT NOT NULL,      -- MIME type of the file
+    content_type TEXT,           -- Exact content type detected at index time
+    size INTEGER,                -- File size in bytes at index time
+    mtime_ns INTEGER,            -- File mtime in nanoseconds at index time
+    width INTEGER,               -- Image width in pixels, as displayed
+    height INTEGER,              -- Image height in pixels, as displayed
+    fingerprint TEXT,            -- Content hash, computed in the background for size and mtime_ns
+    taken_at INTEGER,            -- Capture time in Unix seconds (EXIF, video creation time or track start)
+    orientation INTEGER,         -- EXIF orientation of images
+    duration REAL,               -- Duration of videos and tracks in seconds
+    min_lat REAL,                -- Bounding box of tracks
+    min_lon REAL,
+    max_lat REAL,
+    max_lon REAL,
+    meta_mtime_ns INTEGER,       -- File mtime in nanoseconds the metadata was extracted for
+    sort_key TEXT,               -- Listing order: capture time, or mtime when unknown, then md5
+    UNIQUE (sharemd5, md5)       -- Also serves lookups of a share
 );
+CREATE INDEX files_share_path ON files (sharemd5, path);
+CREATE INDEX files_fingerprint ON files (fingerprint);
+CREATE INDEX files_share_sort ON files (sharemd5, sort_key);
+
+-- Full-text search index of files: share, file name, folder relative to the share,
+-- and type and capture date. Rows share the id of their files row.
+CREATE VIRTUAL TABLE files_fts USING fts5(
+    sharemd5, name, folder, meta, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+-- Rank by name first, then folder, then metadata
+INSERT INTO files_fts (files_fts, rank) VALUES ('rank', 'bm25(0.0, 10.0, 2.0, 1.0)');
+
+CREATE TRIGGER files_fts_insert AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts (rowid, sharemd5, name, folder, meta) VALUES (new.id, new.sharemd5,
+        substr(new.path, length(rtrim(new.path, replace(new.path, '/', ''))) + 1),
+        substr(rtrim(new.path, replace(new.path, '/', '')),
+               length(coalesce((SELECT path FROM shares WHERE md5 = new.sharemd5), '')) + 2),
+        new.mimetype || ' ' || coalesce(new.content_type, '') || ' ' ||
+            coalesce(strftime('%Y-%m-%d', new.taken_at, 'unixepoch'), ''));
+END;
+CREATE TRIGGER files_fts_delete AFTER DELETE ON files BEGIN
+    DELETE FROM files_fts WHERE rowid = old.id;
+END;
+CREATE TRIGGER files_fts_update AFTER UPDATE OF path, mimetype, content_type, taken_at ON files BEGIN
+    DELETE FROM files_fts WHERE rowid = old.id;
+    INSERT INTO files_fts (rowid, sharemd5, name, folder, meta) VALUES (new.id, new.sharemd5,
+        substr(new.path, length(rtrim(new.path, replace(new.path, '/', ''))) + 1),
+        substr(rtrim(new.path, replace(new.path, '/', '')),
+               length(coalesce((SELECT path FROM shares WHERE md5 = new.sharemd5), '')) + 2),
+        new.mimetype || ' ' || coalesce(new.content_type, '') || ' ' ||
+            coalesce(strftime('%Y-%m-%d', new.taken_at, 'unixepoch'), ''));
+END;
 
 -- Table for storing user accounts
 CREATE TABLE users (
@@ -25,3 +78,21 @@ CREATE TABLE users (
     password_hash TEXT NOT NULL,           -- Hashed password
     is_admin INTEGER NOT NULL DEFAULT 0    -- Admin flag (1 for admin, 0 for regular user)
 );
+
+-- Table for tracking background indexing of shares
+CREATE TABLE index_jobs (
+    sharemd5 TEXT PRIMARY KEY,             -- MD5 hash of the indexed share
+    status TEXT NOT NULL,                  -- queued, running, done or failed
+    files_indexed INTEGER NOT NULL DEFAULT 0,  -- Number of files indexed so far
+    error TEXT,                            -- Error message if indexing failed
+    updated_at INTEGER NOT NULL            -- Unix time of the last progress update
+);
+
+-- Table for storing directory state of indexed shares, used by incremental re-indexing
+CREATE TABLE dirs (
+    sharemd5 TEXT NOT NULL,      -- MD5 hash of the parent share
+    path TEXT NOT NULL,          -- File system path to the directory
+    mtime_ns INTEGER NOT NULL,   -- Directory mtime in nanoseconds at the last scan
+    inode INTEGER NOT NULL,      -- Directory inode at the last scan
+    PRIMARY KEY (sharemd5, path)
+);
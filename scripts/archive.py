@@ -0,0 +1,91 @@
+"""
+Archive streaming module for homeCloud application.
+Contains the ZIP64 writer used to download whole shares without temporary files.
+"""
+
+import io
+import zipfile
+
+# Size of the chunks read from files and sent to the client
+CHUNK_SIZE = 1024 * 1024
+
+# Files above this size get ZIP64 headers up front, since their size may
+# cross the 4 GiB limit of plain ZIP headers
+ZIP64_THRESHOLD = 1024 * 1024 * 1024
+
+
+class _StreamBuffer(io.RawIOBase):
+    """
+    Write-only, non-seekable sink for zipfile.
+    zipfile detects that it cannot seek and writes data descriptors after each
+    member instead of patching local headers, so the archive can be sent as it is written.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        """
+        Take everything written since the last call.
+
+        Returns:
+            bytes: Buffered archive data
+        """
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _drain(buffer):
+    """
+    Yield buffered archive data if there is any.
+
+    Args:
+        buffer (_StreamBuffer): Archive sink
+
+    Yields:
+        bytes: Buffered archive data
+    """
+    data = buffer.take()
+    if data:
+        yield data
+
+
+def stream_zip(members):
+    """
+    Write a ZIP64 archive as a generator.
+    Memory use is bounded by CHUNK_SIZE whatever the size of the archive.
+
+    Args:
+        members (iterable): (archive name, file path, compress) tuples; already
+            compressed media should be passed with compress=False to be stored as is
+
+    Yields:
+        bytes: Consecutive parts of the archive
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        for arcname, path, compress in members:
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+                src = open(path, 'rb')
+            except OSError:
+                continue
+            zinfo.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            with src, archive.open(zinfo, 'w', force_zip64=zinfo.file_size >= ZIP64_THRESHOLD) as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield from _drain(buffer)
+            yield from _drain(buffer)
+    yield from _drain(buffer)
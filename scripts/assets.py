@@ -0,0 +1,359 @@
+"""
+Front-end assets module for homeCloud application.
+Contains the vendored library manifest, the build step that stores the libraries
+in content-hashed folders with gzip and brotli copies, and their serving with
+immutable caching.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import threading
+import urllib.request
+
+from flask import current_app, request, send_file, abort, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    # Optional, assets are only precompressed with gzip without it
+    brotli = None
+
+# Vendored libraries: package -> file path inside the package -> (source URL, sha256).
+# Files of a package keep their relative layout, so url() references between
+# them (icon fonts, Leaflet images) work unchanged. The build refuses any file
+# whose content does not match its pinned sha256; `flask assets_build --print-hashes`
+# prints the digests of the current downloads for pinning new versions.
+VENDOR_PACKAGES = {
+    'jquery': {
+        'jquery.min.js': (
+            'https://cdnjs.cloudflare.com/ajax/libs/jquery/3.6.0/jquery.min.js',
+            'ff1523fb7389539c84c65aba19260648793bb4f5e29329d2ee8804bc37a3fe6e'
+        )
+    },
+    'fancybox': {
+        'jquery.fancybox.min.js': (
+            'https://cdnjs.cloudflare.com/ajax/libs/fancybox/3.5.7/jquery.fancybox.min.js',
+            None
+        ),
+        'jquery.fancybox.min.css': (
+            'https://cdnjs.cloudflare.com/ajax/libs/fancybox/3.5.7/jquery.fancybox.min.css',
+            None
+        )
+    },
+    'bootstrap': {
+        'bootstrap.min.css': (
+            'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css',
+            None
+        )
+    },
+    'bootstrap-icons': {
+        'bootstrap-icons.css': (
+            'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.css',
+            None
+        ),
+        'fonts/bootstrap-icons.woff2': (
+            'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/fonts/bootstrap-icons.woff2',
+            None
+        ),
+        'fonts/bootstrap-icons.woff': (
+            'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/fonts/bootstrap-icons.woff',
+            None
+        )
+    },
+    'leaflet': {
+        'leaflet.js': (
+            'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/leaflet.js',
+            'db49d009c841f5ca34a888c96511ae936fd9f5533e90d8b2c4d57596f4e5641a'
+        ),
+        'leaflet.css': (
+            'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/leaflet.css',
+            'a7837102824184820dfa198d1ebcd109ff6d0ff9a2672a074b9a1b4d147d04c6'
+        ),
+        'images/layers.png': (
+            'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/images/layers.png',
+            None
+        ),
+        'images/layers-2x.png': (
+            'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/images/layers-2x.png',
+            None
+        ),
+        'images/marker-icon.png': (
+            'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/images/marker-icon.png',
+            None
+        ),
+        'images/marker-icon-2x.png': (
+            'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/images/marker-icon-2x.png',
+            None
+        ),
+        'images/marker-shadow.png': (
+            'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/images/marker-shadow.png',
+            None
+        )
+    },
+    'hls': {
+        'hls.min.js': (
+            'https://cdn.jsdelivr.net/npm/hls.js@1.5.7/dist/hls.min.js',
+            None
+        )
+    }
+}
+
+# Folder inside the static folder holding the built packages and their manifest
+VENDOR_FOLDER = 'vendor'
+MANIFEST_NAME = 'manifest.json'
+
+# Text assets stored with precompressed copies; fonts and images are already compressed
+PRECOMPRESSED_EXTENSIONS = ('.js', '.css', '.svg', '.json', '.map')
+
+# Precompressed copies by preference: Content-Encoding -> file suffix
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Cache lifetime of hashed asset URLs
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+# Manifest of this process: static folder -> {package: hashed folder name}
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def _download(url):
+    """
+    Download a file.
+
+    Args:
+        url (str): Source URL
+
+    Returns:
+        bytes: File content
+    """
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.read()
+
+
+def _fetch(package, name, url, source=None):
+    """
+    Get the content of a vendored file, downloaded or read from a source folder.
+
+    Args:
+        package (str): Package name
+        name (str): File path inside the package
+        url (str): Source URL
+        source (str): Folder with the files as '<package>/<path>', or None to download
+
+    Returns:
+        bytes: File content
+    """
+    if source is not None:
+        with open(os.path.join(source, package, name), 'rb') as f:
+            return f.read()
+    return _download(url)
+
+
+def _verify(package, name, data, expected):
+    """
+    Check a vendored file against its pinned sha256.
+
+    Args:
+        package (str): Package name
+        name (str): File path inside the package
+        data (bytes): File content
+        expected (str): Pinned sha256 hex digest, or None if not pinned
+
+    Raises:
+        ValueError: If the file is not pinned or its content does not match
+    """
+    actual = hashlib.sha256(data).hexdigest()
+    if expected is None:
+        raise ValueError(f'{package}/{name}: no sha256 pinned in VENDOR_PACKAGES (got {actual})')
+    if actual != expected:
+        raise ValueError(f'{package}/{name}: sha256 {actual} does not match the pinned {expected}')
+
+
+def hash_assets(source=None):
+    """
+    Compute the sha256 of every vendored file, without building anything.
+    Used to pin the digests in VENDOR_PACKAGES after reviewing new versions.
+
+    Args:
+        source (str): Folder with the files as '<package>/<path>' to hash
+            instead of downloading them
+
+    Returns:
+        dict: '<package>/<path>' -> sha256 hex digest
+    """
+    digests = {}
+    for package, files in VENDOR_PACKAGES.items():
+        for name, (url, _) in sorted(files.items()):
+            data = _fetch(package, name, url, source)
+            digests[f'{package}/{name}'] = hashlib.sha256(data).hexdigest()
+    return digests
+
+
+def _precompress(path):
+    """
+    Write gzip and, when available, brotli copies of a file next to it.
+    Copies are written at the highest compression levels, as they are built once.
+
+    Args:
+        path (str): File path
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build_assets(static_folder, source=None):
+    """
+    Build the vendored packages into content-hashed folders.
+    Each file must match its sha256 pinned in VENDOR_PACKAGES, whether downloaded
+    or read from the source folder. Each package is stored as '<package>.<hash>/',
+    the hash covering the content of all its files, so its URLs never change meaning
+    and can be cached as immutable. Text files are precompressed, and the manifest
+    mapping packages to their folders is written last; folders of previous builds
+    are removed.
+
+    Args:
+        static_folder (str): Static folder of the application
+        source (str): Folder with the files as '<package>/<path>' to build from
+            instead of downloading them, for offline builds
+
+    Returns:
+        dict: Manifest, package -> hashed folder name
+
+    Raises:
+        ValueError: If a file is not pinned or does not match its pinned sha256;
+            nothing is written in that case
+    """
+    contents = {}
+    for package, files in VENDOR_PACKAGES.items():
+        contents[package] = {}
+        for name, (url, expected) in sorted(files.items()):
+            data = _fetch(package, name, url, source)
+            _verify(package, name, data, expected)
+            contents[package][name] = data
+
+    root = os.path.join(static_folder, VENDOR_FOLDER)
+    os.makedirs(root, exist_ok=True)
+    manifest = {}
+    for package, files in contents.items():
+        digest = hashlib.sha256()
+        for name, data in files.items():
+            digest.update(name.encode() + b'\0' + hashlib.sha256(data).digest())
+
+        folder = f'{package}.{digest.hexdigest()[:12]}'
+        target = os.path.join(root, folder)
+        if not os.path.isdir(target):
+            tmp = target + '.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+            for name, data in files.items():
+                path = os.path.join(tmp, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                if name.endswith(PRECOMPRESSED_EXTENSIONS):
+                    _precompress(path)
+            os.replace(tmp, target)
+        manifest[package] = folder
+
+    tmp = os.path.join(root, MANIFEST_NAME + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(root, MANIFEST_NAME))
+
+    for entry in os.listdir(root):
+        if entry != MANIFEST_NAME and entry not in manifest.values():
+            path = os.path.join(root, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+    with _manifests_lock:
+        _manifests.pop(static_folder, None)
+    return manifest
+
+
+def _get_manifest(app):
+    """
+    Get the manifest of built packages, read once per process.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        dict: Package -> hashed folder name, empty if the assets were not built
+    """
+    key = app.static_folder
+    with _manifests_lock:
+        if key not in _manifests:
+            try:
+                with open(os.path.join(key, VENDOR_FOLDER, MANIFEST_NAME)) as f:
+                    _manifests[key] = json.load(f)
+            except (OSError, ValueError):
+                _manifests[key] = {}
+        return _manifests[key]
+
+
+def asset_url(package, name):
+    """
+    Get the URL of a vendored file, for use in templates.
+    Before `flask assets_build` has been run, the public CDN URL is returned.
+
+    Args:
+        package (str): Package name in VENDOR_PACKAGES
+        name (str): File path inside the package
+
+    Returns:
+        str: Asset URL
+    """
+    folder = _get_manifest(current_app).get(package)
+    if folder is None:
+        return VENDOR_PACKAGES[package][name][0]
+    return url_for('asset', filename=f'{folder}/{name}')
+
+
+def send_asset(filename):
+    """
+    Serve a built asset as immutable, using a precompressed copy the client accepts.
+
+    Args:
+        filename (str): Path inside the vendor folder
+
+    Returns:
+        File response
+    """
+    path = safe_join(os.path.join(current_app.static_folder, VENDOR_FOLDER), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for candidate, suffix in ENCODINGS:
+        if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+            path, encoding = path + suffix, candidate
+            break
+
+    response = send_file(path, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.content_encoding = encoding
+    return response
+
+
+def init_assets(app):
+    """
+    Register the asset route and the asset_url() template helper.
+
+    Args:
+        app: Flask application instance
+    """
+    app.add_url_rule('/assets/<path:filename>', 'asset', send_asset)
+    app.add_template_global(asset_url)
@@ -0,0 +1,257 @@
+"""
+Benchmark module for homeCloud application.
+Contains synthetic dataset generation and the load generator used by the
+`flask bench` command to measure hot endpoints and indexing throughput.
+"""
+
+import io
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from scripts.db import add_share, init_db, iter_share_files
+from scripts.indexer import index_share
+from helpers import calculate_md5
+
+# Synthetic datasets at scale 1; counts are multiplied by the scale factor
+DATASETS = {
+    'deep': {'depth': 40, 'files_per_dir': 5},
+    'wide': {'dirs': 1000, 'files_per_dir': 2},
+    'small': {'dirs': 50, 'files_per_dir': 200},
+    'huge': {'files': 3, 'size': 1024 ** 3}
+}
+
+# Byte range requested from huge files, so responses stay bounded in memory
+HUGE_RANGE = 1024 * 1024
+
+
+def _sample_jpeg():
+    """
+    Encode a small but valid JPEG used as the content of synthetic photos.
+
+    Returns:
+        bytes: JPEG data
+    """
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), 'gray').save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def _write_files(folder, count, data, prefix='photo'):
+    """
+    Write a number of identical files into a folder.
+
+    Args:
+        folder (str): Destination folder
+        count (int): Number of files
+        data (bytes): File content
+        prefix (str): File name prefix
+    """
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(folder, f'{prefix}_{i:05d}.jpg'), 'wb') as f:
+            f.write(data)
+
+
+def build_datasets(root, scale=1):
+    """
+    Generate the synthetic folder trees.
+    Huge files are sparse, so they take no disk space beyond their metadata.
+
+    Args:
+        root (str): Folder to create the trees in
+        scale (int): Multiplier applied to file and folder counts
+
+    Returns:
+        dict: Dataset name -> folder path
+    """
+    jpeg = _sample_jpeg()
+    folders = {name: os.path.join(root, name) for name in DATASETS}
+
+    spec = DATASETS['deep']
+    path = folders['deep']
+    for level in range(spec['depth'] * scale):
+        path = os.path.join(path, f'level_{level:03d}')
+        _write_files(path, spec['files_per_dir'], jpeg)
+
+    spec = DATASETS['wide']
+    for i in range(spec['dirs'] * scale):
+        _write_files(os.path.join(folders['wide'], f'dir_{i:05d}'), spec['files_per_dir'], jpeg)
+
+    spec = DATASETS['small']
+    for i in range(spec['dirs']):
+        _write_files(os.path.join(folders['small'], f'dir_{i:03d}'), spec['files_per_dir'] * scale, jpeg)
+
+    spec = DATASETS['huge']
+    os.makedirs(folders['huge'], exist_ok=True)
+    for i in range(spec['files']):
+        with open(os.path.join(folders['huge'], f'video_{i}.mp4'), 'wb') as f:
+            f.truncate(spec['size'])
+    return folders
+
+
+def percentile(sorted_values, fraction):
+    """
+    Get a percentile with the nearest-rank method.
+
+    Args:
+        sorted_values (list): Values sorted in ascending order
+        fraction (float): Percentile as a fraction, e.g. 0.95
+
+    Returns:
+        float: Percentile value
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _summarize(latencies, elapsed, errors):
+    """
+    Summarize request latencies.
+
+    Args:
+        latencies (list): Request latencies in seconds
+        elapsed (float): Wall time of the run in seconds
+        errors (int): Number of failed requests
+
+    Returns:
+        dict: Request count, errors, throughput and latency percentiles in milliseconds
+    """
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'requests_per_sec': round(len(values) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else None,
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3) if values else None,
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3) if values else None,
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3) if values else None
+    }
+
+
+def load_test(app, url, requests, concurrency, headers=None, admin=False):
+    """
+    Send requests to an endpoint from several threads and measure latencies.
+    Each thread has its own test client; the response body is read in full.
+
+    Args:
+        app: Flask application instance
+        url (str): URL to request
+        requests (int): Total number of requests
+        concurrency (int): Number of concurrent clients
+        headers (dict): Request headers
+        admin (bool): Log the clients in as admin
+
+    Returns:
+        dict: Summary returned by _summarize()
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client_loop():
+        nonlocal errors
+        client = app.test_client()
+        if admin:
+            with client.session_transaction() as session:
+                session['admin_logged_in'] = True
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            start = time.perf_counter()
+            response = client.get(url, headers=headers)
+            response.get_data()
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                if response.status_code >= 400:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(client_loop) for _ in range(concurrency)]:
+            future.result()
+    return _summarize(latencies, time.perf_counter() - started, errors)
+
+
+def run_benchmarks(create_app, scale=1, requests=200, concurrency=4, keep=False):
+    """
+    Run the benchmark suite against a throwaway database and upload folder.
+
+    Args:
+        create_app (callable): Application factory
+        scale (int): Dataset scale factor
+        requests (int): Requests per endpoint
+        concurrency (int): Concurrent clients per endpoint
+        keep (bool): Keep the temporary folder for inspection; its path is
+            returned as 'workdir'
+
+    Returns:
+        dict: Machine-readable benchmark results
+    """
+    workdir = tempfile.mkdtemp(prefix='homecloud-bench-')
+    try:
+        upload_folder = os.path.join(workdir, 'data')
+        app = create_app(os.getenv('FLASK_ENV', 'default'))
+        app.config.update(DATABASE=os.path.join(workdir, 'bench.db'), UPLOAD_FOLDER=upload_folder)
+
+        started = time.perf_counter()
+        folders = build_datasets(upload_folder, scale)
+        results = {
+            'scale': scale,
+            'requests': requests,
+            'concurrency': concurrency,
+            'dataset_build_sec': round(time.perf_counter() - started, 3),
+            'indexing': {},
+            'endpoints': {}
+        }
+
+        shares = {}
+        with app.app_context():
+            init_db(app)
+            for name, folder in folders.items():
+                share_md5 = calculate_md5(folder)
+                add_share(app, share_md5, folder)
+                started = time.perf_counter()
+                added, _removed = index_share(app, share_md5, folder)
+                elapsed = time.perf_counter() - started
+                results['indexing'][name] = {
+                    'files': added,
+                    'seconds': round(elapsed, 3),
+                    'files_per_sec': round(added / elapsed, 1) if elapsed else None
+                }
+                started = time.perf_counter()
+                index_share(app, share_md5, folder)
+                results['indexing'][name]['unchanged_rescan_sec'] = round(time.perf_counter() - started, 3)
+                shares[name] = (share_md5, [row['md5'] for row in iter_share_files(app, share_md5, limit=1)])
+
+        small_md5, small_files = shares['small']
+        huge_md5, huge_files = shares['huge']
+        endpoints = {
+            'folder_tree': ('/admin/folder-tree', None, True),
+            'share_listing': (f'/share/all/{small_md5}', None, False),
+            'share_listing_page': (f'/share/all/{small_md5}?limit=500', None, False),
+            'file_small': (f'/share/{small_md5}/{small_files[0]}', None, False),
+            'file_huge_range': (f'/share/{huge_md5}/{huge_files[0]}',
+                                {'Range': f'bytes=0-{HUGE_RANGE - 1}'}, False)
+        }
+        for name, (url, headers, admin) in endpoints.items():
+            # Warm up caches so runs measure the steady state
+            load_test(app, url, min(requests, 10), 1, headers, admin)
+            results['endpoints'][name] = load_test(app, url, requests, concurrency, headers, admin)
+        if keep:
+            results['workdir'] = workdir
+        return results
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
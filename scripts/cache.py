@@ -0,0 +1,176 @@
+"""
+Cache helpers module for homeCloud application.
+Contains the in-process LRU cache and size-capped, least-recently-used
+eviction for on-disk caches.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Last prune time per cache folder: folder -> monotonic seconds
+_last_prune = {}
+_prune_lock = threading.Lock()
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded least-recently-used cache with a time to live.
+    invalidate() bumps a version counter instead of walking the entries:
+    entries stored under an older version count as misses and age out of the LRU.
+    """
+
+    def __init__(self, maxsize, ttl):
+        """
+        Args:
+            maxsize (int): Maximum number of entries
+            ttl (float): Entry lifetime in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up an entry.
+
+        Args:
+            key: Hashable cache key
+
+        Returns:
+            tuple: (True, value) on a hit, (False, None) on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                version, expires, value = entry
+                if version == self.version and expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, version=None):
+        """
+        Store an entry, evicting the least recently used one when full.
+
+        Args:
+            key: Hashable cache key
+            value: Value to store, None included
+            version (int): Cache version read before the value was loaded; the
+                value is dropped if the cache was invalidated in the meantime
+        """
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._entries[key] = (self.version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """
+        Invalidate all entries.
+        """
+        with self._lock:
+            self.version += 1
+
+    def stats(self):
+        """
+        Get cache counters.
+
+        Returns:
+            dict: Hits, misses, current number of entries and version
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'version': self.version
+            }
+
+
+def touch(path):
+    """
+    Mark a cached file as recently used.
+
+    Args:
+        path (str): Path of the cached file
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def prune_folder(folder, max_bytes):
+    """
+    Delete least recently used files until a cache folder fits its size cap.
+    Files are evicted by mtime, which touch() refreshes on every cache hit,
+    down to 90% of the cap so pruning does not run on every write.
+
+    Args:
+        folder (str): Cache folder
+        max_bytes (int): Size cap in bytes
+
+    Returns:
+        int: Number of bytes freed
+    """
+    entries = []
+    total = 0
+    for root, _dirs, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total <= max_bytes:
+        return 0
+
+    freed = 0
+    target = total - max_bytes * 0.9
+    entries.sort()
+    for _mtime, size, path in entries:
+        if freed >= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        freed += size
+
+    for root, dirs, files in os.walk(folder, topdown=False):
+        if root != folder and not dirs and not files:
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+    return freed
+
+
+def maybe_prune(folder, max_bytes, interval=60):
+    """
+    Prune a cache folder at most once per interval.
+
+    Args:
+        folder (str): Cache folder
+        max_bytes (int): Size cap in bytes
+        interval (int): Minimum seconds between two prunes of the folder
+    """
+    now = time.monotonic()
+    with _prune_lock:
+        if now - _last_prune.get(folder, -interval) < interval:
+            return
+        _last_prune[folder] = now
+    prune_folder(folder, max_bytes)
@@ -0,0 +1,91 @@
+"""
+Concurrency helpers module for homeCloud application.
+Contains helpers that move blocking work off the event loop when the application
+is served by gevent workers, and run it inline under regular threaded workers.
+"""
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from gevent import monkey, get_hub
+    from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+except ImportError:
+    monkey = None
+
+
+def is_cooperative():
+    """
+    Check whether the process runs on a gevent event loop.
+
+    Returns:
+        bool: True if threading is monkey-patched by gevent
+    """
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def make_thread_pool(max_workers, thread_name_prefix=''):
+    """
+    Create a thread pool whose workers are real OS threads.
+    Under gevent, the standard ThreadPoolExecutor would run its workers as
+    greenlets, and long CPU or disk bound jobs would stall every request.
+
+    Args:
+        max_workers (int): Maximum number of worker threads
+        thread_name_prefix (str): Worker thread name prefix
+
+    Returns:
+        concurrent.futures.Executor: Thread pool
+    """
+    if is_cooperative():
+        return NativeThreadPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+
+def run_blocking(app, func, *args, **kwargs):
+    """
+    Run a blocking call without stalling the event loop.
+    Under gevent the call runs on the hub's native thread pool, bounded to
+    BLOCKING_POOL_SIZE threads, while the calling greenlet waits cooperatively;
+    the current context (Flask application and request) is carried along.
+    Otherwise the call simply runs in the current thread.
+
+    Args:
+        app: Flask application instance
+        func (callable): Blocking function
+        *args: Positional arguments of the function
+        **kwargs: Keyword arguments of the function
+
+    Returns:
+        Result of the function
+    """
+    if not is_cooperative():
+        return func(*args, **kwargs)
+    pool = get_hub().threadpool
+    if pool.maxsize != app.config['BLOCKING_POOL_SIZE']:
+        pool.maxsize = app.config['BLOCKING_POOL_SIZE']
+    context = contextvars.copy_context()
+    return pool.apply(context.run, (func,) + args, kwargs)
+
+
+def iter_blocking(app, iterable):
+    """
+    Iterate over a blocking iterator, producing each item with run_blocking().
+
+    Args:
+        app: Flask application instance
+        iterable (iterable): Iterator doing blocking work to produce its items
+
+    Yields:
+        Items of the iterator
+    """
+    iterator = iter(iterable)
+    if not is_cooperative():
+        yield from iterator
+        return
+    done = object()
+    while True:
+        item = run_blocking(app, next, iterator, done)
+        if item is done:
+            return
+        yield item
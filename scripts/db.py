@@ -3,14 +3,305 @@ Database operations module for homeCloud application.
 Contains functions for database initialization and data manipulation.
 """
 
+import os
+import queue
 import sqlite3
+import threading
+import time
 from flask import g
+
+from scripts.cache import LRUCache
+from scripts.metrics import record_query
 from werkzeug.security import generate_password_hash, check_password_hash
 
 
+# Search index columns of a file row: file name, folder relative to the share, and
+# type and capture date. Kept in sync with the files table by triggers; index rows
+# carry the id of their files row, which unlike an implicit rowid survives VACUUM.
+_FTS_VALUES = """new.id, new.sharemd5,
+    substr(new.path, length(rtrim(new.path, replace(new.path, '/', ''))) + 1),
+    substr(rtrim(new.path, replace(new.path, '/', '')),
+           length(coalesce((SELECT path FROM shares WHERE md5 = new.sharemd5), '')) + 2),
+    new.mimetype || ' ' || coalesce(new.content_type, '') || ' ' ||
+        coalesce(strftime('%Y-%m-%d', new.taken_at, 'unixepoch'), '')"""
+# The same columns keyed by the implicit rowid, as used by migration 8 before files had an id
+_FTS_ROWID_VALUES = _FTS_VALUES.replace('new.id,', 'new.rowid,', 1)
+
+# Schema migrations for databases created by older versions, applied in order.
+# PRAGMA user_version holds the number of migrations already applied.
+MIGRATIONS = [
+    # 1: background indexing and incremental re-indexing tables
+    [
+        """CREATE TABLE IF NOT EXISTS index_jobs (
+            sharemd5 TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            files_indexed INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at INTEGER NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS dirs (
+            sharemd5 TEXT NOT NULL,
+            path TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            PRIMARY KEY (sharemd5, path)
+        )""",
+    ],
+    # 2: files keyed by (sharemd5, md5) so lookups and listings of a share use an index
+    [
+        """CREATE TABLE files_new (
+            sharemd5 TEXT NOT NULL,
+            md5 TEXT NOT NULL,
+            path TEXT NOT NULL,
+            mimetype TEXT NOT NULL,
+            PRIMARY KEY (sharemd5, md5)
+        )""",
+        'INSERT OR IGNORE INTO files_new (sharemd5, md5, path, mimetype) SELECT sharemd5, md5, path, mimetype FROM files',
+        'DROP TABLE files',
+        'ALTER TABLE files_new RENAME TO files',
+        'CREATE INDEX files_share_path ON files (sharemd5, path)',
+    ],
+    # 3: share index version, used for listing ETags
+    [
+        'ALTER TABLE shares ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+    ],
+    # 4: exact content type detected at index time
+    [
+        'ALTER TABLE files ADD COLUMN content_type TEXT',
+    ],
+    # 5: file size, version and image dimensions, used for viewer preload hints
+    [
+        'ALTER TABLE files ADD COLUMN size INTEGER',
+        'ALTER TABLE files ADD COLUMN mtime_ns INTEGER',
+        'ALTER TABLE files ADD COLUMN width INTEGER',
+        'ALTER TABLE files ADD COLUMN height INTEGER',
+    ],
+    # 6: content fingerprint, shared by duplicate files across shares
+    [
+        'ALTER TABLE files ADD COLUMN fingerprint TEXT',
+        'CREATE INDEX files_fingerprint ON files (fingerprint)',
+    ],
+    # 7: media metadata and the capture time ordering of share listings
+    [
+        'ALTER TABLE files ADD COLUMN taken_at INTEGER',
+        'ALTER TABLE files ADD COLUMN orientation INTEGER',
+        'ALTER TABLE files ADD COLUMN duration REAL',
+        'ALTER TABLE files ADD COLUMN min_lat REAL',
+        'ALTER TABLE files ADD COLUMN min_lon REAL',
+        'ALTER TABLE files ADD COLUMN max_lat REAL',
+        'ALTER TABLE files ADD COLUMN max_lon REAL',
+        'ALTER TABLE files ADD COLUMN meta_mtime_ns INTEGER',
+        'ALTER TABLE files ADD COLUMN sort_key TEXT',
+        # Until metadata is extracted, files are ordered by modification time
+        "UPDATE files SET sort_key = printf('%011d', coalesce(mtime_ns / 1000000000, 0)) || ':' || md5",
+        'CREATE INDEX files_share_sort ON files (sharemd5, sort_key)',
+        'UPDATE shares SET version = version + 1',
+    ],
+    # 8: full-text search index of file names, folders and metadata
+    [
+        """CREATE VIRTUAL TABLE files_fts USING fts5(
+            sharemd5, name, folder, meta, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )""",
+        "INSERT INTO files_fts (files_fts, rank) VALUES ('rank', 'bm25(0.0, 10.0, 2.0, 1.0)')",
+        f'CREATE TRIGGER files_fts_insert AFTER INSERT ON files BEGIN '
+        f'INSERT INTO files_fts (rowid, sharemd5, name, folder, meta) VALUES ({_FTS_ROWID_VALUES}); END',
+        'CREATE TRIGGER files_fts_delete AFTER DELETE ON files BEGIN '
+        'DELETE FROM files_fts WHERE rowid = old.rowid; END',
+        f'CREATE TRIGGER files_fts_update AFTER UPDATE OF path, mimetype, content_type, taken_at ON files BEGIN '
+        f'DELETE FROM files_fts WHERE rowid = old.rowid; '
+        f'INSERT INTO files_fts (rowid, sharemd5, name, folder, meta) VALUES ({_FTS_ROWID_VALUES}); END',
+        'INSERT INTO files_fts (rowid, sharemd5, name, folder, meta) SELECT '
+        + _FTS_ROWID_VALUES.replace('new.', 'files.') + ' FROM files',
+    ],
+    # 9: explicit file ids for the search index, since VACUUM may renumber implicit rowids
+    [
+        """CREATE TABLE files_new (
+            id INTEGER PRIMARY KEY,
+            sharemd5 TEXT NOT NULL,
+            md5 TEXT NOT NULL,
+            path TEXT NOT NULL,
+            mimetype TEXT NOT NULL,
+            content_type TEXT,
+            size INTEGER,
+            mtime_ns INTEGER,
+            width INTEGER,
+            height INTEGER,
+            fingerprint TEXT,
+            taken_at INTEGER,
+            orientation INTEGER,
+            duration REAL,
+            min_lat REAL,
+            min_lon REAL,
+            max_lat REAL,
+            max_lon REAL,
+            meta_mtime_ns INTEGER,
+            sort_key TEXT,
+            UNIQUE (sharemd5, md5)
+        )""",
+        # Ids keep the insertion order of the old rowids, which orders search results by recency
+        'INSERT INTO files_new SELECT rowid, sharemd5, md5, path, mimetype, content_type, size, mtime_ns, width, '
+        'height, fingerprint, taken_at, orientation, duration, min_lat, min_lon, max_lat, max_lon, '
+        'meta_mtime_ns, sort_key FROM files ORDER BY rowid',
+        'DROP TABLE files',
+        'ALTER TABLE files_new RENAME TO files',
+        'CREATE INDEX files_share_path ON files (sharemd5, path)',
+        'CREATE INDEX files_fingerprint ON files (fingerprint)',
+        'CREATE INDEX files_share_sort ON files (sharemd5, sort_key)',
+        f'CREATE TRIGGER files_fts_insert AFTER INSERT ON files BEGIN '
+        f'INSERT INTO files_fts (rowid, sharemd5, name, folder, meta) VALUES ({_FTS_VALUES}); END',
+        'CREATE TRIGGER files_fts_delete AFTER DELETE ON files BEGIN '
+        'DELETE FROM files_fts WHERE rowid = old.id; END',
+        f'CREATE TRIGGER files_fts_update AFTER UPDATE OF path, mimetype, content_type, taken_at ON files BEGIN '
+        f'DELETE FROM files_fts WHERE rowid = old.id; '
+        f'INSERT INTO files_fts (rowid, sharemd5, name, folder, meta) VALUES ({_FTS_VALUES}); END',
+        # Rebuild the index in case the database was vacuumed since it was filled
+        'DELETE FROM files_fts',
+        'INSERT INTO files_fts (rowid, sharemd5, name, folder, meta) SELECT '
+        + _FTS_VALUES.replace('new.', 'files.') + ' FROM files',
+    ],
+]
+
+# Idle connections kept for reuse: (process id, database path) -> LifoQueue of connections
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Lookup caches of share rows, file rows and admin state: database path -> LRUCache
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class _InstrumentedConnection(sqlite3.Connection):
+    """
+    Connection that counts queries and the time spent executing them in the current request.
+    """
+
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            record_query(time.perf_counter() - start)
+
+    def executemany(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            record_query(time.perf_counter() - start)
+
+
+def connect_db(app):
+    """
+    Open a new tuned database connection.
+    Enables WAL so readers are not blocked by writers, relaxes fsync to
+    synchronous=NORMAL (safe with WAL) and memory-maps the database file.
+    With METRICS_ENABLED, queries are counted and timed per request.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        sqlite3.Connection: Database connection object
+    """
+    db = sqlite3.connect(app.config['DATABASE'],
+                         timeout=app.config['DB_TIMEOUT'],
+                         cached_statements=app.config['DB_CACHED_STATEMENTS'],
+                         check_same_thread=False,
+                         factory=_InstrumentedConnection if app.config['METRICS_ENABLED'] else sqlite3.Connection)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA journal_mode = WAL')
+    db.execute('PRAGMA synchronous = NORMAL')
+    # Rows replaced by INSERT OR REPLACE fire the delete triggers keeping files_fts in sync
+    db.execute('PRAGMA recursive_triggers = ON')
+    db.execute(f"PRAGMA mmap_size = {int(app.config['DB_MMAP_SIZE'])}")
+    return db
+
+
+def _get_pool(app):
+    """
+    Get the pool of idle connections of the current process.
+    Pools are keyed by process id so that forked workers never share connections.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        queue.LifoQueue: Idle connections
+    """
+    key = (os.getpid(), app.config['DATABASE'])
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = queue.LifoQueue()
+        return _pools[key]
+
+
+def _get_cache(app):
+    """
+    Get the lookup cache of the current database, creating it on first use.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        LRUCache: Lookup cache
+    """
+    key = app.config['DATABASE']
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = LRUCache(app.config['DB_CACHE_SIZE'], app.config['DB_CACHE_TTL'])
+        return _caches[key]
+
+
+def _cached(app, key, load):
+    """
+    Get a lookup result from the cache, loading and storing it on a miss.
+    Results written by other processes become visible after DB_CACHE_TTL at the latest.
+
+    Args:
+        app: Flask application instance
+        key (tuple): Cache key
+        load (callable): Function loading the result from the database
+
+    Returns:
+        Cached or freshly loaded result
+    """
+    cache = _get_cache(app)
+    hit, value = cache.get(key)
+    if not hit:
+        version = cache.version
+        value = load()
+        cache.set(key, value, version)
+    return value
+
+
+def invalidate_cache(app):
+    """
+    Invalidate cached lookups after a write.
+
+    Args:
+        app: Flask application instance
+    """
+    _get_cache(app).invalidate()
+
+
+def cache_stats(app):
+    """
+    Get hit and miss counters of the lookup cache.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        dict: Hits, misses, current number of entries and version
+    """
+    return _get_cache(app).stats()
+
+
 def get_db(app):
     """
     Get database connection from Flask application context.
+    Connections are long-lived: an idle connection of this process is reused
+    when available, so statement caches and the memory map survive between requests.
 
     Args:
         app: Flask application instance
@@ -19,11 +310,31 @@ def get_db(app):
         sqlite3.Connection: Database connection object
     """
     if 'db' not in g:
-        g.db = sqlite3.connect(app.config['DATABASE'])
-        g.db.row_factory = sqlite3.Row
+        try:
+            g.db = _get_pool(app).get_nowait()
+        except queue.Empty:
+            g.db = connect_db(app)
     return g.db
 
 
+def release_db(app, db):
+    """
+    Return a connection to the pool of idle connections.
+    Uncommitted changes are rolled back; connections above DB_POOL_SIZE are closed.
+
+    Args:
+        app: Flask application instance
+        db (sqlite3.Connection): Connection obtained from get_db()
+    """
+    if db.in_transaction:
+        db.rollback()
+    pool = _get_pool(app)
+    if pool.qsize() < app.config['DB_POOL_SIZE']:
+        pool.put(db)
+    else:
+        db.close()
+
+
 def init_db(app):
     """
     Initialize database with schema from schema.sql file.
@@ -34,7 +345,38 @@ def init_db(app):
     db = get_db(app)
     with app.open_resource('schema.sql', mode='r') as f:
         db.cursor().executescript(f.read())
+    db.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
     db.commit()
+    invalidate_cache(app)
+
+
+def migrate_db(app):
+    """
+    Apply pending schema migrations to an existing database.
+    Databases without tables are left alone, they are created by init_db().
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        int: Number of applied migrations
+    """
+    db = get_db(app)
+    if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files'").fetchone() is None:
+        return 0
+
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        for statements in MIGRATIONS[version:]:
+            for statement in statements:
+                db.execute(statement)
+        db.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return max(len(MIGRATIONS) - version, 0)
 
 
 def add_share(app, md5, path):
@@ -49,9 +391,23 @@ def add_share(app, md5, path):
     db = get_db(app)
     db.execute('INSERT INTO shares (md5, path) VALUES (?, ?)', (md5, path))
     db.commit()
+    g.pop('share_md5s', None)
+    invalidate_cache(app)
+
+
+def _bump_share_versions(db, sharemd5s):
+    """
+    Increase the index version of shares whose files changed.
+    Runs inside the caller's transaction.
+
+    Args:
+        db (sqlite3.Connection): Database connection
+        sharemd5s (iterable): MD5 hashes of the changed shares
+    """
+    db.executemany('UPDATE shares SET version = version + 1 WHERE md5 = ?', [(md5,) for md5 in set(sharemd5s)])
 
 
-def add_file(app, sharemd5, md5, path, mimeType):
+def add_file(app, sharemd5, md5, path, mimeType, contentType=None):
     """
     Add a file to a share in the database.
 
@@ -61,16 +417,235 @@ def add_file(app, sharemd5, md5, path, mimeType):
         md5 (str): MD5 hash of the file
         path (str): File system path to the file
         mimeType (str): MIME type of the file
+        contentType (str): Exact content type of the file
+    """
+    db = get_db(app)
+    db.execute('INSERT INTO files (sharemd5, md5, path, mimetype, content_type) VALUES (?, ?, ?, ?, ?)',
+               (sharemd5, md5, path, mimeType, contentType))
+    _bump_share_versions(db, [sharemd5])
+    db.commit()
+    invalidate_cache(app)
+
+
+def add_files(app, rows):
+    """
+    Add many files to the database in a single transaction.
+
+    Args:
+        app: Flask application instance
+        rows (list): List of (sharemd5, md5, path, mimetype, content_type, size,
+            mtime_ns, width, height, taken_at, orientation, duration, min_lat,
+            min_lon, max_lat, max_lon, meta_mtime_ns, sort_key) tuples
+    """
+    db = get_db(app)
+    db.executemany('INSERT OR REPLACE INTO files (sharemd5, md5, path, mimetype, content_type, '
+                   'size, mtime_ns, width, height, taken_at, orientation, duration, min_lat, min_lon, '
+                   'max_lat, max_lon, meta_mtime_ns, sort_key) '
+                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    _bump_share_versions(db, [row[0] for row in rows])
+    db.commit()
+    invalidate_cache(app)
+
+
+def delete_files(app, sharemd5, md5s):
+    """
+    Delete many files of a share in a single transaction.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the parent share
+        md5s (list): MD5 hashes of the files to delete
+    """
+    db = get_db(app)
+    db.executemany('DELETE FROM files WHERE sharemd5 = ? AND md5 = ?', [(sharemd5, md5) for md5 in md5s])
+    _bump_share_versions(db, [sharemd5])
+    db.commit()
+    invalidate_cache(app)
+
+
+def set_file_fingerprints(app, sharemd5, rows):
+    """
+    Store content fingerprints of files of a share in a single transaction.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the parent share
+        rows (list): List of (md5, size, mtime_ns, fingerprint) tuples, with the
+            size and mtime the fingerprint was computed for
+    """
+    db = get_db(app)
+    db.executemany('UPDATE files SET size = ?, mtime_ns = ?, fingerprint = ? WHERE sharemd5 = ? AND md5 = ?',
+                   [(size, mtime_ns, fingerprint, sharemd5, md5) for md5, size, mtime_ns, fingerprint in rows])
+    _bump_share_versions(db, [sharemd5])
+    db.commit()
+    invalidate_cache(app)
+
+
+def set_file_metadata(app, sharemd5, rows):
+    """
+    Store re-extracted media metadata of files of a share in a single transaction.
+    Fingerprints of files whose size or mtime changed are cleared.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the parent share
+        rows (list): List of (md5, size, mtime_ns, width, height, taken_at, orientation,
+            duration, min_lat, min_lon, max_lat, max_lon, meta_mtime_ns, sort_key) tuples
+    """
+    db = get_db(app)
+    db.executemany('UPDATE files SET fingerprint = CASE WHEN size IS ? AND mtime_ns IS ? THEN fingerprint END, '
+                   'size = ?, mtime_ns = ?, width = ?, height = ?, taken_at = ?, orientation = ?, duration = ?, '
+                   'min_lat = ?, min_lon = ?, max_lat = ?, max_lon = ?, meta_mtime_ns = ?, sort_key = ? '
+                   'WHERE sharemd5 = ? AND md5 = ?',
+                   [(row[1], row[2]) + row[1:] + (sharemd5, row[0]) for row in rows])
+    _bump_share_versions(db, [sharemd5])
+    db.commit()
+    invalidate_cache(app)
+
+
+def clear_file_fingerprints(app, sharemd5, md5s):
+    """
+    Clear stale content fingerprints of files of a share.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the parent share
+        md5s (list): MD5 hashes of the files
+    """
+    db = get_db(app)
+    db.executemany('UPDATE files SET fingerprint = NULL WHERE sharemd5 = ? AND md5 = ?',
+                   [(sharemd5, md5) for md5 in md5s])
+    db.commit()
+    invalidate_cache(app)
+
+
+def _path_range(path):
+    """
+    Get the bounds of the path range covering everything below a directory.
+
+    Args:
+        path (str): Directory path
+
+    Returns:
+        tuple: (lower bound inclusive, upper bound exclusive)
+    """
+    return path + os.sep, path + chr(ord(os.sep) + 1)
+
+
+def get_dir_files(app, sharemd5, path):
+    """
+    Get files of a share located directly in a directory.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        path (str): Directory path
+
+    Returns:
+        dict: File paths mapped to records with md5, mimetype, size and mtime_ns
+    """
+    db = get_db(app)
+    low, high = _path_range(path)
+    rows = db.execute('SELECT md5, path, mimetype, size, mtime_ns FROM files '
+                      'WHERE sharemd5 = ? AND path >= ? AND path < ?',
+                      (sharemd5, low, high))
+    return {row['path']: row for row in rows if os.path.dirname(row['path']) == path}
+
+
+def get_share_dirs(app, sharemd5):
+    """
+    Get the stored directory state of a share.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+
+    Returns:
+        dict: Directory paths mapped to (mtime_ns, inode) tuples
+    """
+    db = get_db(app)
+    rows = db.execute('SELECT path, mtime_ns, inode FROM dirs WHERE sharemd5 = ?', (sharemd5,))
+    return {row['path']: (row['mtime_ns'], row['inode']) for row in rows}
+
+
+def set_share_dirs(app, sharemd5, rows):
+    """
+    Store the state of many directories of a share in a single transaction.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        rows (list): List of (path, mtime_ns, inode) tuples
+    """
+    db = get_db(app)
+    db.executemany('INSERT OR REPLACE INTO dirs (sharemd5, path, mtime_ns, inode) VALUES (?, ?, ?, ?)',
+                   [(sharemd5,) + row for row in rows])
+    db.commit()
+
+
+def delete_share_dirs(app, sharemd5, paths):
+    """
+    Delete removed directories of a share together with everything indexed below them.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        paths (list): Paths of the removed directories
+
+    Returns:
+        int: Number of deleted files
+    """
+    db = get_db(app)
+    deleted = 0
+    for path in paths:
+        low, high = _path_range(path)
+        db.execute('DELETE FROM dirs WHERE sharemd5 = ? AND (path = ? OR (path >= ? AND path < ?))',
+                   (sharemd5, path, low, high))
+        deleted += db.execute('DELETE FROM files WHERE sharemd5 = ? AND path >= ? AND path < ?',
+                              (sharemd5, low, high)).rowcount
+    _bump_share_versions(db, [sharemd5])
+    db.commit()
+    invalidate_cache(app)
+    return deleted
+
+
+def set_index_job(app, sharemd5, status, files_indexed=0, error=None):
+    """
+    Create or update the indexing job record of a share.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        status (str): Job status (queued, running, done or failed)
+        files_indexed (int): Number of files indexed so far
+        error (str): Error message if indexing failed
     """
     db = get_db(app)
-    db.execute('INSERT INTO files (sharemd5, md5, path, mimetype) VALUES (?, ?, ?, ?)',
-               (sharemd5, md5, path, mimeType))
+    db.execute('INSERT OR REPLACE INTO index_jobs (sharemd5, status, files_indexed, error, updated_at) '
+               'VALUES (?, ?, ?, ?, ?)', (sharemd5, status, files_indexed, error, int(time.time())))
     db.commit()
 
 
+def get_index_job(app, sharemd5):
+    """
+    Get the indexing job record of a share.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+
+    Returns:
+        sqlite3.Row or None: Job record or None if the share was never indexed
+    """
+    db = get_db(app)
+    job = db.execute('SELECT * FROM index_jobs WHERE sharemd5 = ?', (sharemd5,)).fetchone()
+    return job
+
+
 def get_share(app, md5):
     """
     Get share information by MD5 hash.
+    Served from the lookup cache when possible.
 
     Args:
         app: Flask application instance
@@ -79,14 +654,33 @@ def get_share(app, md5):
     Returns:
         sqlite3.Row or None: Share record or None if not found
     """
-    db = get_db(app)
-    share = db.execute('SELECT * FROM shares WHERE md5 = ?', (md5,)).fetchone()
-    return share
+    def load():
+        db = get_db(app)
+        return db.execute('SELECT * FROM shares WHERE md5 = ?', (md5,)).fetchone()
+    return _cached(app, ('share', md5), load)
+
+
+def get_share_md5s(app):
+    """
+    Get MD5 hashes of all shares as a set.
+    Loaded with a single query and kept for the rest of the request,
+    so checking many folders for being shared costs one round-trip.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        set: MD5 hashes of all shares
+    """
+    if 'share_md5s' not in g:
+        db = get_db(app)
+        g.share_md5s = {row['md5'] for row in db.execute('SELECT md5 FROM shares')}
+    return g.share_md5s
 
 
 def get_share_files(app, sharemd5):
     """
-    Get all files belonging to a share.
+    Get all files belonging to a share, ordered by capture time.
 
     Args:
         app: Flask application instance
@@ -97,13 +691,155 @@ def get_share_files(app, sharemd5):
     """
     db = get_db(app)
     share = db.execute(
-        'SELECT * FROM files WHERE sharemd5 = ?', (sharemd5,)).fetchall()
+        'SELECT * FROM files WHERE sharemd5 = ? ORDER BY sort_key', (sharemd5,)).fetchall()
     return share
 
 
+def get_share_version(app, sharemd5):
+    """
+    Get the index version of a share.
+    The version changes whenever files of the share are added or removed.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+
+    Returns:
+        int or None: Index version or None if the share does not exist
+    """
+    db = get_db(app)
+    row = db.execute('SELECT version FROM shares WHERE md5 = ?', (sharemd5,)).fetchone()
+    return None if row is None else row['version']
+
+
+def iter_share_files(app, sharemd5, after=None, limit=None):
+    """
+    Iterate over files of a share ordered by MD5 without loading them all.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        after (str): Only return files whose MD5 sorts after this one (pagination cursor)
+        limit (int): Maximum number of files to return
+
+    Returns:
+        sqlite3.Cursor: Cursor over file records
+    """
+    db = get_db(app)
+    return db.execute(
+        'SELECT * FROM files WHERE sharemd5 = ? AND md5 > ? ORDER BY md5 LIMIT ?',
+        (sharemd5, after or '', -1 if limit is None else limit))
+
+
+def iter_share_media(app, sharemd5, after=None, limit=None):
+    """
+    Iterate over files of a share in the listing order of the viewer:
+    by capture time, or modification time when unknown, read from the files_share_sort index.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        after (str): Only return files whose sort key sorts after this one (pagination cursor)
+        limit (int): Maximum number of files to return
+
+    Returns:
+        sqlite3.Cursor: Cursor over file records
+    """
+    db = get_db(app)
+    return db.execute(
+        'SELECT * FROM files WHERE sharemd5 = ? AND sort_key > ? ORDER BY sort_key LIMIT ?',
+        (sharemd5, after or '', -1 if limit is None else limit))
+
+
+def get_neighbour_files(app, sharemd5, sort_key, count):
+    """
+    Get the files around a file in the share listing order (by sort key).
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        sort_key (str): Sort key of the file
+        count (int): Number of files to return on each side
+
+    Returns:
+        tuple: (previous files nearest first, next files nearest first)
+    """
+    db = get_db(app)
+    previous = db.execute(
+        'SELECT * FROM files WHERE sharemd5 = ? AND sort_key < ? ORDER BY sort_key DESC LIMIT ?',
+        (sharemd5, sort_key, count)).fetchall()
+    following = db.execute(
+        'SELECT * FROM files WHERE sharemd5 = ? AND sort_key > ? ORDER BY sort_key LIMIT ?',
+        (sharemd5, sort_key, count)).fetchall()
+    return previous, following
+
+
+def list_dir_files(app, sharemd5, path, after=None, limit=1000):
+    """
+    Get a page of files of a share located anywhere below a directory, ordered by path.
+    Callers page with the after argument instead of holding a cursor open, so long
+    downloads do not keep a read transaction (and the WAL) open.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        path (str): Directory path
+        after (str): Only return files whose path sorts after this one (pagination cursor)
+        limit (int): Maximum number of files to return
+
+    Returns:
+        list: List of file records
+    """
+    db = get_db(app)
+    low, high = _path_range(path)
+    return db.execute(
+        'SELECT * FROM files WHERE sharemd5 = ? AND path >= ? AND path < ? AND path > ? ORDER BY path LIMIT ?',
+        (sharemd5, low, high, after or '', limit)).fetchall()
+
+
+def search_files(app, match, sharemd5=None, limit=50, offset=0, window=2000):
+    """
+    Search files by name, folder and metadata in the full-text index.
+    Ranking is linear in the number of matches, so only the window most recently
+    indexed matches are ranked, best first; further matches follow, newest first.
+    A strong match among older files therefore comes after the window's weaker
+    matches when a search has more matches than the window.
+
+    Args:
+        app: Flask application instance
+        match (str): FTS5 query on the name, folder and meta columns
+        sharemd5 (str): Only search files of this share
+        limit (int): Maximum number of files to return
+        offset (int): Number of matches to skip (pagination)
+        window (int): Number of matches ranked
+
+    Returns:
+        list: List of file records
+    """
+    if sharemd5 is not None:
+        # The share MD5 is a single token, so the index itself narrows the search to the share
+        match = f'sharemd5 : "{sharemd5}" AND ({match})'
+    db = get_db(app)
+    rowids = []
+    if offset < window:
+        rowids = [row[0] for row in db.execute(
+            'SELECT rowid FROM (SELECT rowid, rank FROM files_fts WHERE files_fts MATCH ? ORDER BY rowid DESC LIMIT ?) '
+            'ORDER BY rank LIMIT ? OFFSET ?', (match, window, limit, offset))]
+    if len(rowids) < limit:
+        rowids += [row[0] for row in db.execute(
+            'SELECT rowid FROM files_fts WHERE files_fts MATCH ? ORDER BY rowid DESC LIMIT ? OFFSET ?',
+            (match, limit - len(rowids), max(offset, window)))]
+    if not rowids:
+        return []
+    files = {file['id']: file for file in db.execute(
+        f'SELECT * FROM files WHERE id IN ({", ".join("?" * len(rowids))})', rowids)}
+    return [files[rowid] for rowid in rowids if rowid in files]
+
+
 def get_share_file(app, sharemd5, md5):
     """
     Get specific file from a share.
+    Served from the lookup cache when possible.
 
     Args:
         app: Flask application instance
@@ -113,10 +849,11 @@ def get_share_file(app, sharemd5, md5):
     Returns:
         sqlite3.Row or None: File record or None if not found
     """
-    db = get_db(app)
-    share = db.execute(
-        'SELECT * FROM files WHERE sharemd5 = ? AND md5 = ?', (sharemd5, md5,)).fetchone()
-    return share
+    def load():
+        db = get_db(app)
+        return db.execute(
+            'SELECT * FROM files WHERE sharemd5 = ? AND md5 = ?', (sharemd5, md5,)).fetchone()
+    return _cached(app, ('file', sharemd5, md5), load)
 
 
 def get_all_shares(app):
@@ -136,17 +873,27 @@ def get_all_shares(app):
 
 def create_admin_user(app, username, password):
     """
-    Create a new admin user in the database.
+    Create the first admin user in the database.
+    The insert itself checks that no admin exists yet, so concurrent
+    registrations in several processes cannot create a second admin.
 
     Args:
         app: Flask application instance
         username (str): Username for the admin
         password (str): Plain text password (will be hashed)
+
+    Returns:
+        bool: True if the admin was created, False if an admin already exists
     """
     db = get_db(app)
     password_hash = generate_password_hash(password)
-    db.execute('INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, 1)', (username, password_hash))
+    cursor = db.execute(
+        'INSERT INTO users (username, password_hash, is_admin) SELECT ?, ?, 1 '
+        'WHERE NOT EXISTS (SELECT 1 FROM users WHERE is_admin = 1)',
+        (username, password_hash))
     db.commit()
+    invalidate_cache(app)
+    return cursor.rowcount == 1
 
 
 def get_user_by_username(app, username):
@@ -168,6 +915,8 @@ def get_user_by_username(app, username):
 def check_admin_exists(app):
     """
     Check if any admin user exists in the database.
+    Only a positive answer is cached: admins are never removed, while a cached
+    negative answer could let another process register a second admin.
 
     Args:
         app: Flask application instance
@@ -175,6 +924,13 @@ def check_admin_exists(app):
     Returns:
         bool: True if admin exists, False otherwise
     """
+    cache = _get_cache(app)
+    hit, _value = cache.get(('admin_exists',))
+    if hit:
+        return True
+    version = cache.version
     db = get_db(app)
-    user = db.execute('SELECT * FROM users WHERE is_admin = 1').fetchone()
-    return user is not None
\ No newline at end of file
+    exists = db.execute('SELECT 1 FROM users WHERE is_admin = 1 LIMIT 1').fetchone() is not None
+    if exists:
+        cache.set(('admin_exists',), True, version)
+    return exists
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Content fingerprint module for homeCloud application.
+Contains the background content hashing of indexed files, used to key
+thumbnails, transcodes and ETags by content so duplicates are processed once.
+"""
+
+import hashlib
+import mmap
+import os
+
+try:
+    import xxhash
+except ImportError:
+    # Optional, BLAKE2 from the standard library is used without it
+    xxhash = None
+
+from scripts.db import iter_share_files, set_file_fingerprints, clear_file_fingerprints
+from scripts.scanner import get_scan_executor
+
+# Size of the chunks fed to the hash function
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _new_hash():
+    """
+    Create the content hash object.
+
+    Returns:
+        tuple: (algorithm name, hash object)
+    """
+    if xxhash is not None:
+        return 'xxh128', xxhash.xxh3_128()
+    return 'b2', hashlib.blake2b(digest_size=16)
+
+
+def fingerprint_file(filepath):
+    """
+    Compute the content fingerprint of a file.
+    The file is memory-mapped and hashed in chunks, so no read buffers are copied.
+
+    Args:
+        filepath (str): Path to the file
+
+    Returns:
+        str: Fingerprint as 'algorithm:hexdigest'
+    """
+    algorithm, digest = _new_hash()
+    with open(filepath, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, CHUNK_SIZE):
+                        digest.update(view[offset:offset + CHUNK_SIZE])
+                finally:
+                    view.release()
+    return f'{algorithm}:{digest.hexdigest()}'
+
+
+def current_fingerprint(file, st=None):
+    """
+    Get the fingerprint of a file record if it still matches the file on disk.
+    A fingerprint is only trusted while the size and mtime stored with it are current.
+
+    Args:
+        file (sqlite3.Row): File record
+        st (os.stat_result): File status, read from disk if not given
+
+    Returns:
+        str or None: Fingerprint, or None if missing or stale
+    """
+    if file['fingerprint'] is None:
+        return None
+    if st is None:
+        try:
+            st = os.stat(file['path'])
+        except OSError:
+            return None
+    if (file['size'], file['mtime_ns']) != (st.st_size, st.st_mtime_ns):
+        return None
+    return file['fingerprint']
+
+
+def _fingerprint_row(row):
+    """
+    Fingerprint the file of a record.
+
+    Args:
+        row (tuple): (md5, path)
+
+    Returns:
+        tuple or None: (md5, size, mtime_ns, fingerprint) or None if the file cannot be read
+    """
+    md5, path = row
+    try:
+        st = os.stat(path)
+        fingerprint = fingerprint_file(path)
+    except (OSError, ValueError):
+        return None
+    return md5, st.st_size, st.st_mtime_ns, fingerprint
+
+
+def _is_stale(file):
+    """
+    Check whether a fingerprinted file changed since it was hashed.
+
+    Args:
+        file (sqlite3.Row): File record
+
+    Returns:
+        bool: True if the file has a fingerprint that no longer matches it
+    """
+    return file['fingerprint'] is not None and current_fingerprint(file) is None
+
+
+def fingerprint_share(app, sharemd5, recheck=False):
+    """
+    Fill in missing content fingerprints of a share.
+    With recheck, every file is stat'ed first and fingerprints of files whose
+    size or mtime changed are cleared, so only changed files are hashed again.
+    Files are checked and hashed concurrently on the scan pool, one page at a time.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        recheck (bool): Detect files changed since they were fingerprinted
+
+    Returns:
+        int: Number of files fingerprinted
+    """
+    executor = get_scan_executor()
+    done = 0
+    after = None
+    while True:
+        files = iter_share_files(app, sharemd5, after, app.config['INDEXER_BATCH_SIZE']).fetchall()
+        if not files:
+            return done
+        after = files[-1]['md5']
+
+        missing = [(file['md5'], file['path']) for file in files if file['fingerprint'] is None]
+        if recheck:
+            stale = [(file['md5'], file['path']) for file, is_stale in zip(files, executor.map(_is_stale, files))
+                     if is_stale]
+            if stale:
+                clear_file_fingerprints(app, sharemd5, [md5 for md5, _path in stale])
+                missing.extend(stale)
+        rows = [row for row in executor.map(_fingerprint_row, missing) if row is not None]
+        if rows:
+            set_file_fingerprints(app, sharemd5, rows)
+            done += len(rows)
@@ -0,0 +1,298 @@
+"""
+GPX track module for homeCloud application.
+Contains streaming GPX parsing, Douglas-Peucker simplification and the
+per-zoom track cache used by the map external viewer.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+
+# Map zoom levels with a precomputed simplification; a request for zoom z gets
+# the first level >= z, so the track is never coarser than one screen pixel
+TRACK_ZOOM_LEVELS = [6, 9, 12, 15, 18]
+
+# Serializes cache builds per track within this process
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+
+
+def _point(elem):
+    """
+    Read the coordinates of a track or route point.
+
+    Args:
+        elem (xml.etree.ElementTree.Element): trkpt or rtept element
+
+    Returns:
+        tuple or None: (latitude, longitude), or None if an attribute is missing or malformed
+    """
+    try:
+        return float(elem.get('lat')), float(elem.get('lon'))
+    except (TypeError, ValueError):
+        return None
+
+
+def read_track(src):
+    """
+    Read all track and route points of a GPX file with a streaming parser.
+    Segments are joined into a single line; elements are released as soon as
+    they are read, so memory grows only with the number of points.
+    Points with missing or malformed coordinates are skipped.
+
+    Args:
+        src (str): GPX file path
+
+    Returns:
+        numpy.ndarray: Array of shape (n, 2) with latitude and longitude
+    """
+    coords = array('d')
+    for _event, elem in ET.iterparse(src):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag in ('trkpt', 'rtept'):
+            point = _point(elem)
+            if point is not None:
+                coords.extend(point)
+            elem.clear()
+        elif tag in ('trkseg', 'trk', 'rte'):
+            elem.clear()
+    return np.frombuffer(coords, dtype=np.float64).reshape(-1, 2)
+
+
+def track_summary(src):
+    """
+    Read the start and end time and the bounding box of a GPX track with a streaming parser.
+
+    Args:
+        src (str): GPX file path
+
+    Returns:
+        tuple: (first point time, last point time, (min_lat, min_lon, max_lat, max_lon));
+            times are ISO 8601 strings or None, the box is None without points
+    """
+    start = end = None
+    min_lat = min_lon = float('inf')
+    max_lat = max_lon = float('-inf')
+    for _event, elem in ET.iterparse(src):
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag in ('trkpt', 'rtept'):
+            point = _point(elem)
+            if point is None:
+                elem.clear()
+                continue
+            lat, lon = point
+            min_lat, max_lat = min(min_lat, lat), max(max_lat, lat)
+            min_lon, max_lon = min(min_lon, lon), max(max_lon, lon)
+            for child in elem:
+                if child.tag.rsplit('}', 1)[-1] == 'time' and child.text:
+                    start = start or child.text.strip()
+                    end = child.text.strip()
+            elem.clear()
+        elif tag in ('trkseg', 'trk', 'rte'):
+            elem.clear()
+    bbox = (min_lat, min_lon, max_lat, max_lon) if min_lat <= max_lat else None
+    return start, end, bbox
+
+
+def _zoom_tolerance(zoom):
+    """
+    Get the simplification tolerance for a zoom level.
+
+    Args:
+        zoom (int): Map zoom level
+
+    Returns:
+        float: Size of one screen pixel at the zoom level, in degrees
+    """
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Simplify a polyline with the Douglas-Peucker algorithm.
+    Distances of every point in a span are computed with one vectorized NumPy
+    operation, so the Python loop only runs once per kept point.
+
+    Args:
+        points (numpy.ndarray): Array of shape (n, 2) with projected coordinates
+        tolerance (float): Maximum distance of dropped points from the simplified line
+
+    Returns:
+        numpy.ndarray: Boolean mask of the points to keep
+    """
+    count = len(points)
+    keep = np.zeros(count, dtype=bool)
+    if count == 0:
+        return keep
+    keep[0] = keep[-1] = True
+
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a = points[start]
+        segment = points[end] - a
+        rel = points[start + 1:end] - a
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            distances = np.abs(segment[0] * rel[:, 1] - segment[1] * rel[:, 0]) / length
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def simplify_track(track, zoom):
+    """
+    Simplify a track for display at a zoom level.
+
+    Args:
+        track (numpy.ndarray): Array of shape (n, 2) with latitude and longitude
+        zoom (int): Map zoom level
+
+    Returns:
+        numpy.ndarray: Simplified array of latitude and longitude
+    """
+    if len(track) < 3:
+        return track
+    # Equirectangular projection, so longitude and latitude distances are comparable
+    scale = np.cos(np.radians(track[:, 0].mean()))
+    projected = np.column_stack((track[:, 1] * scale, track[:, 0]))
+    return track[douglas_peucker(projected, _zoom_tolerance(zoom))]
+
+
+def encode_polyline(track):
+    """
+    Encode points with the encoded polyline algorithm (precision 5).
+
+    Args:
+        track (numpy.ndarray): Array of shape (n, 2) with latitude and longitude
+
+    Returns:
+        str: Encoded polyline
+    """
+    if len(track) == 0:
+        return ''
+    values = np.round(track * 1e5).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    chars = []
+    for value in deltas.tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
+
+
+def track_level(zoom):
+    """
+    Get the precomputed simplification level to use for a zoom level.
+
+    Args:
+        zoom (int): Map zoom level
+
+    Returns:
+        int: One of TRACK_ZOOM_LEVELS
+    """
+    for level in TRACK_ZOOM_LEVELS:
+        if level >= zoom:
+            return level
+    return TRACK_ZOOM_LEVELS[-1]
+
+
+def _track_cache_dir(app, md5, filepath, fingerprint=None):
+    """
+    Get the cache directory of a track.
+    Keyed by the content fingerprint when known, otherwise by file MD5, mtime
+    and size, so an edited track is simplified again.
+
+    Args:
+        app: Flask application instance
+        md5 (str): MD5 hash of the file
+        filepath (str): Path to the GPX file
+        fingerprint (str): Current content fingerprint of the file
+
+    Returns:
+        str: Cache directory path
+    """
+    if fingerprint is not None:
+        key = hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+    else:
+        st = os.stat(filepath)
+        key = hashlib.sha1(f'{md5}:{st.st_mtime_ns}:{st.st_size}'.encode('utf-8')).hexdigest()
+    return os.path.join(app.root_path, app.config['TRACK_CACHE_FOLDER'], key[:2], key)
+
+
+def _build_track_cache(cache_dir, filepath):
+    """
+    Parse a track once and write its bounds and all simplification levels.
+
+    Args:
+        cache_dir (str): Cache directory of the track
+        filepath (str): Path to the GPX file
+    """
+    track = read_track(filepath)
+    tmp_dir = f'{cache_dir}.{os.getpid()}.{threading.get_ident()}.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    for level in TRACK_ZOOM_LEVELS:
+        with open(os.path.join(tmp_dir, f'{level}.txt'), 'w', encoding='ascii') as f:
+            f.write(encode_polyline(simplify_track(track, level)))
+    bounds = None
+    if len(track):
+        bounds = [track.min(axis=0).tolist(), track.max(axis=0).tolist()]
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'bounds': bounds, 'points': len(track)}, f)
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        # Another worker finished the same track first
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+def get_track(app, md5, filepath, zoom, fingerprint=None):
+    """
+    Get a track simplified for a zoom level, building the cache on first use.
+
+    Args:
+        app: Flask application instance
+        md5 (str): MD5 hash of the file
+        filepath (str): Path to the GPX file
+        zoom (int): Map zoom level
+        fingerprint (str): Current content fingerprint of the file
+
+    Returns:
+        dict: 'zoom' (level used), 'levels', 'bounds', 'points' and encoded 'polyline'
+    """
+    cache_dir = _track_cache_dir(app, md5, filepath, fingerprint)
+    if not os.path.isdir(cache_dir):
+        with _build_locks_lock:
+            lock = _build_locks.setdefault(cache_dir, threading.Lock())
+        with lock:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+                _build_track_cache(cache_dir, filepath)
+        with _build_locks_lock:
+            _build_locks.pop(cache_dir, None)
+
+    level = track_level(zoom)
+    with open(os.path.join(cache_dir, 'meta.json'), encoding='utf-8') as f:
+        track = json.load(f)
+    with open(os.path.join(cache_dir, f'{level}.txt'), encoding='ascii') as f:
+        track['polyline'] = f.read()
+    track['zoom'] = level
+    track['levels'] = TRACK_ZOOM_LEVELS
+    return track
@@ -0,0 +1,252 @@
+"""
+HLS streaming module for homeCloud application.
+Contains on-demand HLS playlists and segment transcoding with ffmpeg,
+backed by a size-capped LRU segment cache.
+"""
+
+import hashlib
+import json
+import math
+import os
+import subprocess
+import threading
+from functools import lru_cache
+
+from scripts.cache import touch, maybe_prune
+
+# Bitrate ladder: rung name -> (short frame edge, video bitrate, audio bitrate);
+# the short edge is used so portrait phone videos get the same quality as landscape ones
+HLS_LADDER = {
+    '360p': (360, 800000, 96000),
+    '720p': (720, 2500000, 128000),
+    '1080p': (1080, 5000000, 160000)
+}
+
+_semaphore = None
+_semaphore_lock = threading.Lock()
+# Serializes transcoding of the same segment within this process
+_segment_locks = {}
+
+
+def _get_semaphore(app):
+    """
+    Get the semaphore limiting concurrent transcode jobs, creating it on first use.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        threading.BoundedSemaphore: Transcode job limiter
+    """
+    global _semaphore
+    with _semaphore_lock:
+        if _semaphore is None:
+            _semaphore = threading.BoundedSemaphore(app.config['HLS_MAX_JOBS'])
+        return _semaphore
+
+
+@lru_cache(maxsize=1024)
+def _probe(ffprobe, filepath, mtime_ns, size):
+    """
+    Read duration and frame size of a video with ffprobe.
+    Cached per file version, mtime_ns and size are part of the cache key.
+
+    Args:
+        ffprobe (str): Path to the ffprobe binary
+        filepath (str): Path to the video
+        mtime_ns (int): File mtime in nanoseconds
+        size (int): File size in bytes
+
+    Returns:
+        dict: 'duration' in seconds, 'width' and 'height' in pixels
+    """
+    output = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'v:0',
+                             '-show_entries', 'stream=width,height:format=duration',
+                             '-of', 'json', filepath],
+                            check=True, capture_output=True, timeout=30, stdin=subprocess.DEVNULL).stdout
+    info = json.loads(output)
+    stream = info['streams'][0]
+    return {
+        'duration': float(info['format']['duration']),
+        'width': int(stream['width']),
+        'height': int(stream['height'])
+    }
+
+
+def probe(app, filepath):
+    """
+    Read duration and frame size of a video.
+
+    Args:
+        app: Flask application instance
+        filepath (str): Path to the video
+
+    Returns:
+        dict: 'duration' in seconds, 'width' and 'height' in pixels
+    """
+    st = os.stat(filepath)
+    return _probe(app.config['FFPROBE_BINARY'], filepath, st.st_mtime_ns, st.st_size)
+
+
+def available_rungs(info):
+    """
+    Get the ladder rungs that do not upscale the source video.
+
+    Args:
+        info (dict): Result of probe()
+
+    Returns:
+        list: Rung names, lowest first; the lowest rung is always included
+    """
+    short_edge = min(info['width'], info['height'])
+    rungs = [name for name, (edge, _vbr, _abr) in HLS_LADDER.items() if edge <= short_edge]
+    return rungs or [next(iter(HLS_LADDER))]
+
+
+def master_playlist(info):
+    """
+    Build the master playlist listing one variant per available rung.
+
+    Args:
+        info (dict): Result of probe()
+
+    Returns:
+        str: Master playlist
+    """
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for name in available_rungs(info):
+        edge, video_bitrate, audio_bitrate = HLS_LADDER[name]
+        scale = edge / min(info['width'], info['height'])
+        width = int(round(info['width'] * scale / 2)) * 2
+        height = int(round(info['height'] * scale / 2)) * 2
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={video_bitrate + audio_bitrate},RESOLUTION={width}x{height}')
+        lines.append(f'{name}/index.m3u8')
+    return '\n'.join(lines) + '\n'
+
+
+def media_playlist(app, info):
+    """
+    Build a VOD media playlist of fixed-length segments.
+    Segments are listed up front and only transcoded when requested.
+
+    Args:
+        app: Flask application instance
+        info (dict): Result of probe()
+
+    Returns:
+        str: Media playlist
+    """
+    segment_seconds = app.config['HLS_SEGMENT_SECONDS']
+    count = max(1, math.ceil(info['duration'] / segment_seconds))
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{segment_seconds}',
+             '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD']
+    for index in range(count):
+        duration = min(segment_seconds, info['duration'] - index * segment_seconds)
+        lines.append(f'#EXTINF:{duration:.3f},')
+        lines.append(f'{index}.ts')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def _segment_path(app, md5, filepath, rung, index, fingerprint=None):
+    """
+    Get the cache path of a segment, keyed by the content fingerprint when known
+    and by file MD5, mtime and size otherwise.
+
+    Args:
+        app: Flask application instance
+        md5 (str): MD5 hash of the file
+        filepath (str): Path to the video
+        rung (str): Ladder rung name
+        index (int): Segment number
+        fingerprint (str): Current content fingerprint of the file
+
+    Returns:
+        str: Path of the cached segment
+    """
+    if fingerprint is not None:
+        source = fingerprint
+    else:
+        st = os.stat(filepath)
+        source = f'{md5}:{st.st_mtime_ns}:{st.st_size}'
+    key = hashlib.sha1(f'{source}:{app.config["HLS_SEGMENT_SECONDS"]}'.encode('utf-8')).hexdigest()
+    return os.path.join(app.root_path, app.config['HLS_CACHE_FOLDER'], key[:2], key, rung, f'{index}.ts')
+
+
+def _transcode_segment(app, filepath, rung, index, dst):
+    """
+    Transcode one segment with ffmpeg.
+    Output timestamps are offset to the segment start so segments play back to back.
+
+    Args:
+        app: Flask application instance
+        filepath (str): Path to the video
+        rung (str): Ladder rung name
+        index (int): Segment number
+        dst (str): Destination segment path
+    """
+    edge, video_bitrate, audio_bitrate = HLS_LADDER[rung]
+    segment_seconds = app.config['HLS_SEGMENT_SECONDS']
+    start = index * segment_seconds
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f'{dst}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        subprocess.run([app.config['FFMPEG_BINARY'], '-v', 'error', '-y',
+                        '-ss', str(start), '-t', str(segment_seconds), '-i', filepath,
+                        '-map', '0:v:0', '-map', '0:a:0?',
+                        '-vf', f"scale='if(gt(iw,ih),-2,{edge})':'if(gt(iw,ih),{edge},-2)'",
+                        '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+                        '-b:v', str(video_bitrate), '-maxrate', str(video_bitrate),
+                        '-bufsize', str(video_bitrate * 2),
+                        '-c:a', 'aac', '-b:a', str(audio_bitrate), '-ac', '2',
+                        '-output_ts_offset', str(start), '-muxdelay', '0',
+                        '-f', 'mpegts', tmp],
+                       check=True, timeout=app.config['HLS_TRANSCODE_TIMEOUT'], stdin=subprocess.DEVNULL)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def get_segment(app, md5, filepath, rung, index, fingerprint=None):
+    """
+    Get a segment, transcoding it if it is not cached.
+    At most HLS_MAX_JOBS segments are transcoded at the same time in a process;
+    the cache is pruned to HLS_CACHE_MAX_BYTES, least recently used first.
+
+    Args:
+        app: Flask application instance
+        md5 (str): MD5 hash of the file
+        filepath (str): Path to the video
+        rung (str): Ladder rung name
+        index (int): Segment number
+        fingerprint (str): Current content fingerprint of the file
+
+    Returns:
+        str or None: Path of the segment or None if the transcode slots stayed busy
+    """
+    dst = _segment_path(app, md5, filepath, rung, index, fingerprint)
+    if os.path.exists(dst):
+        touch(dst)
+        return dst
+
+    with _semaphore_lock:
+        lock = _segment_locks.setdefault(dst, threading.Lock())
+    try:
+        with lock:
+            if os.path.exists(dst):
+                return dst
+            semaphore = _get_semaphore(app)
+            if not semaphore.acquire(timeout=app.config['HLS_TRANSCODE_TIMEOUT']):
+                return None
+            try:
+                _transcode_segment(app, filepath, rung, index, dst)
+            finally:
+                semaphore.release()
+    finally:
+        with _semaphore_lock:
+            _segment_locks.pop(dst, None)
+
+    cache_folder = os.path.join(app.root_path, app.config['HLS_CACHE_FOLDER'])
+    maybe_prune(cache_folder, app.config['HLS_CACHE_MAX_BYTES'])
+    return dst
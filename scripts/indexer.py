@@ -0,0 +1,332 @@
+"""
+Share indexing module for homeCloud application.
+Contains the background indexer that fills the files table when a folder is shared
+and keeps it in sync with the file system.
+"""
+
+import os
+import threading
+from collections import defaultdict
+
+from scripts.concurrency import make_thread_pool
+from scripts.db import add_files, delete_files, get_dir_files, get_share_dirs, set_share_dirs, delete_share_dirs, set_index_job, set_file_metadata
+from scripts.fingerprint import fingerprint_share
+from scripts.metadata import describe_metadata, refresh_share_metadata, sort_key
+from scripts.mimetypes import detectMimeType
+from scripts.scanner import get_scan_executor, forget_dir
+from helpers import calculate_md5
+
+_executor = None
+_executor_lock = threading.Lock()
+# Jobs queued or running in this process: share MD5 -> Future
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _get_executor(app):
+    """
+    Get the worker pool used for indexing jobs, creating it on first use.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        concurrent.futures.Executor: Indexing worker pool
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = make_thread_pool(app.config['INDEXER_WORKERS'], thread_name_prefix='indexer')
+        return _executor
+
+
+def _list_dir(path):
+    """
+    List a directory level.
+    Symlinked directories are not descended into, as with os.walk: they may
+    lead outside the share or back up into it.
+
+    Args:
+        path (str): Directory to list
+
+    Returns:
+        tuple: (list of file entries, list of subdirectory paths)
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        files.append(entry)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return files, subdirs
+
+
+class _ShareSync:
+    """
+    Incremental synchronisation of a share's files table with the file system.
+    Directories whose mtime and inode match the stored state are not listed again;
+    changed directories are listed and their differences applied as deltas,
+    including files whose size or mtime changed in place.
+    File system access runs on the scanner's thread pool.
+    """
+
+    def __init__(self, app, sharemd5):
+        """
+        Args:
+            app: Flask application instance
+            sharemd5 (str): MD5 hash of the share
+        """
+        self.app = app
+        self.sharemd5 = sharemd5
+        self.batch_size = app.config['INDEXER_BATCH_SIZE']
+        self.stored = get_share_dirs(app, sharemd5)
+        self.children = defaultdict(list)
+        for dirpath in self.stored:
+            self.children[os.path.dirname(dirpath)].append(dirpath)
+        self.new_rows = []
+        self.modified_rows = []
+        self.removed_md5s = []
+        self.dir_rows = []
+        self.added = 0
+        self.removed = 0
+
+    def flush(self, force=False):
+        """
+        Write pending changes once a batch is full.
+        The metadata of new and modified files is extracted on the metadata process pool first.
+
+        Args:
+            force (bool): Write pending changes even if the batch is not full
+        """
+        pending = len(self.new_rows) + len(self.modified_rows) + len(self.removed_md5s)
+        if force or pending >= self.batch_size:
+            if self.new_rows:
+                metadata = describe_metadata(self.app, [(row[2], row[3]) for row in self.new_rows])
+                add_files(self.app, [row + values + (row[6], sort_key(values[2], row[6], row[1]))
+                                     for row, values in zip(self.new_rows, metadata)])
+                self.added += len(self.new_rows)
+            if self.modified_rows:
+                metadata = describe_metadata(self.app, [(row[1], row[2]) for row in self.modified_rows])
+                set_file_metadata(self.app, self.sharemd5,
+                                  [(md5, size, mtime_ns) + values + (mtime_ns, sort_key(values[2], mtime_ns, md5))
+                                   for (md5, _path, _mimetype, size, mtime_ns), values
+                                   in zip(self.modified_rows, metadata)])
+            if self.removed_md5s:
+                delete_files(self.app, self.sharemd5, self.removed_md5s)
+                self.removed += len(self.removed_md5s)
+            if self.dir_rows:
+                set_share_dirs(self.app, self.sharemd5, self.dir_rows)
+            self.new_rows, self.modified_rows, self.removed_md5s, self.dir_rows = [], [], [], []
+            set_index_job(self.app, self.sharemd5, 'running', self.added)
+
+    def probe_dir(self, path, force):
+        """
+        Stat a directory and list it if it changed since the last scan.
+        Runs on the scan pool and only reads the stored state.
+
+        Args:
+            path (str): Directory to probe
+            force (bool): List the directory even if its state is unchanged
+
+        Returns:
+            tuple: (state or None if the directory is gone, listing or None if unchanged)
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None, None
+        state = (st.st_mtime_ns, st.st_ino)
+        if not force and self.stored.get(path) == state:
+            return state, None
+        return state, _list_dir(path)
+
+    def describe_files(self, entries):
+        """
+        Build file rows for new files, reading their type.
+        Runs on the scan pool; stat results are cached by the directory entries.
+
+        Args:
+            entries (list): os.DirEntry objects of the new files
+
+        Returns:
+            list: (sharemd5, md5, path, mimetype, content_type, size, mtime_ns) tuples,
+                completed with metadata by flush()
+        """
+        rows = []
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            mimetype, content_type = detectMimeType(entry.path)
+            rows.append((self.sharemd5, calculate_md5(entry.path), entry.path,
+                         mimetype, content_type, st.st_size, st.st_mtime_ns))
+        return rows
+
+    def modified_files(self, known):
+        """
+        Find known files whose size or mtime changed since they were indexed.
+        Runs on the scan pool; stat results are cached by the directory entries.
+
+        Args:
+            known (list): (file record, os.DirEntry) tuples of indexed files
+
+        Returns:
+            list: (md5, path, mimetype, size, mtime_ns) tuples of the changed files
+        """
+        rows = []
+        for file, entry in known:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if (file['size'], file['mtime_ns']) != (st.st_size, st.st_mtime_ns):
+                rows.append((file['md5'], entry.path, file['mimetype'], st.st_size, st.st_mtime_ns))
+        return rows
+
+    def sync(self, start, force=()):
+        """
+        Synchronise a directory subtree.
+        The tree is walked level by level: directories of a level are probed and
+        their new and modified files described concurrently on the scan pool, while
+        database reads and writes stay on the calling thread.
+
+        Args:
+            start (str): Root directory of the subtree
+            force (iterable): Directories to rescan even if their state is unchanged
+        """
+        executor = get_scan_executor()
+        visited = set()
+        level = [start]
+        while level:
+            probes = executor.map(lambda path: self.probe_dir(path, path in force), level)
+            next_level = []
+            changed = []
+            for path, (state, listing) in zip(level, probes):
+                if state is None:
+                    continue
+                visited.add(path)
+                if listing is None:
+                    next_level.extend(self.children[path])
+                    continue
+                files, subdirs = listing
+                next_level.extend(subdirs)
+                existing = get_dir_files(self.app, self.sharemd5, path)
+                new_entries = []
+                known = []
+                for entry in files:
+                    file = existing.pop(entry.path, None)
+                    if file is None:
+                        new_entries.append(entry)
+                    else:
+                        known.append((file, entry))
+                self.removed_md5s.extend(file['md5'] for file in existing.values())
+                changed.append((path, state, new_entries, known))
+
+            described = executor.map(lambda item: (self.describe_files(item[2]), self.modified_files(item[3])),
+                                     changed)
+            for (path, state, _new_entries, _known), (rows, modified) in zip(changed, described):
+                self.new_rows.extend(rows)
+                self.modified_rows.extend(modified)
+                self.dir_rows.append((path,) + state)
+                self.flush()
+            level = next_level
+        self.flush(force=True)
+
+        prefix = start + os.sep
+        gone = [dirpath for dirpath in self.stored
+                if (dirpath == start or dirpath.startswith(prefix)) and dirpath not in visited]
+        if gone:
+            self.removed += delete_share_dirs(self.app, self.sharemd5, gone)
+
+
+def index_share(app, sharemd5, path, dirty=None, recheck=False):
+    """
+    Index files of a shared folder into the files table.
+    Indexing is incremental: only directories whose mtime or inode changed since
+    the previous run are listed, and added or removed files are applied as deltas.
+    Rows are written in batches of INDEXER_BATCH_SIZE, one transaction per batch,
+    and the job progress is updated after every batch. Files of listed directories
+    whose size or mtime changed get their metadata re-extracted and their fingerprint
+    cleared. Files edited in place do not change their directory's mtime, so a
+    recheck stats every indexed file once to find the remaining ones. The folder
+    scanner's cached sizes of the synchronised directories, or of the whole share
+    on a recheck, are dropped as well. With FINGERPRINT_ENABLED, files without
+    a fingerprint are fingerprinted afterwards.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        path (str): File system path to the shared folder
+        dirty (iterable): Directories known to have changed; when given, only their
+            subtrees are synchronised instead of the whole share
+        recheck (bool): Stat every indexed file to find files changed in place
+
+    Returns:
+        tuple: (number of added files, number of removed files)
+    """
+    set_index_job(app, sharemd5, 'running')
+
+    share_sync = _ShareSync(app, sharemd5)
+    if dirty is None:
+        share_sync.sync(path)
+    else:
+        for dirpath in dirty:
+            share_sync.sync(dirpath, force={dirpath})
+            forget_dir(dirpath)
+
+    if recheck:
+        forget_dir(path)
+        refresh_share_metadata(app, sharemd5)
+    if app.config['FINGERPRINT_ENABLED']:
+        fingerprint_share(app, sharemd5)
+
+    set_index_job(app, sharemd5, 'done', share_sync.added)
+    return share_sync.added, share_sync.removed
+
+
+def _run_job(app, sharemd5, path, recheck):
+    """
+    Run an indexing job inside its own application context.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        path (str): File system path to the shared folder
+        recheck (bool): Stat every indexed file to find files changed in place
+    """
+    with app.app_context():
+        try:
+            index_share(app, sharemd5, path, recheck=recheck)
+        except Exception as e:
+            app.logger.exception('Indexing of share %s failed', sharemd5)
+            set_index_job(app, sharemd5, 'failed', error=str(e))
+        finally:
+            with _jobs_lock:
+                _jobs.pop(sharemd5, None)
+
+
+def start_indexing(app, sharemd5, path, recheck=False):
+    """
+    Queue a background indexing job for a share.
+    A share that is already queued or being indexed in this process is not queued twice.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+        path (str): File system path to the shared folder
+        recheck (bool): Stat every indexed file to find files changed in place
+    """
+    with _jobs_lock:
+        if sharemd5 in _jobs:
+            return
+        set_index_job(app, sharemd5, 'queued')
+        _jobs[sharemd5] = _get_executor(app).submit(_run_job, app, sharemd5, path, recheck)
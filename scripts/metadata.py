@@ -0,0 +1,277 @@
+"""
+Media metadata module for homeCloud application.
+Contains the extraction of capture time, orientation, dimensions, duration and
+track bounding boxes during indexing, run in batches on a process pool.
+"""
+
+import calendar
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import repeat
+
+from PIL import Image
+
+from scripts.db import iter_share_files, set_file_metadata
+from scripts.gpx import track_summary
+from scripts.scanner import get_scan_executor
+
+# Files sent to a metadata worker at once
+METADATA_BATCH_SIZE = 64
+
+# EXIF tags: orientation and date/time in IFD0, original capture time in the Exif IFD
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+
+# Metadata of a file that could not be read:
+# (width, height, taken_at, orientation, duration, min_lat, min_lon, max_lat, max_lon)
+NO_METADATA = (None,) * 9
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(app):
+    """
+    Get the process pool used for metadata extraction, creating it on first use.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        ProcessPoolExecutor: Metadata worker pool
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=app.config['METADATA_WORKERS'])
+        return _executor
+
+
+def _exif_time(value):
+    """
+    Parse an EXIF date/time, which carries no time zone and is read as UTC.
+
+    Args:
+        value (str): Date/time as 'YYYY:MM:DD HH:MM:SS'
+
+    Returns:
+        int or None: Unix time in seconds, or None if missing or malformed
+    """
+    try:
+        return calendar.timegm(time.strptime(value.strip('\x00 ')[:19], '%Y:%m:%d %H:%M:%S'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _iso_time(value):
+    """
+    Parse an ISO 8601 date/time; values without a time zone are read as UTC.
+
+    Args:
+        value (str): Date/time, e.g. '2024-05-01T12:00:00.000000Z'
+
+    Returns:
+        int or None: Unix time in seconds, or None if missing or malformed
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def _image_metadata(filepath):
+    """
+    Read dimensions, orientation and capture time of an image from its header.
+    Sides are swapped for EXIF orientations that rotate by 90 degrees.
+
+    Args:
+        filepath (str): Path to the image
+
+    Returns:
+        tuple: Metadata in the order of NO_METADATA
+    """
+    with Image.open(filepath) as img:
+        width, height = img.size
+        exif = img.getexif()
+    orientation = exif.get(EXIF_ORIENTATION)
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    taken_at = _exif_time(exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL)) or _exif_time(exif.get(EXIF_DATETIME))
+    return width, height, taken_at, orientation, None, None, None, None, None
+
+
+def _video_metadata(filepath, ffprobe):
+    """
+    Read dimensions, duration and creation time of a video with ffprobe.
+
+    Args:
+        filepath (str): Path to the video
+        ffprobe (str): Path to the ffprobe binary
+
+    Returns:
+        tuple: Metadata in the order of NO_METADATA
+    """
+    output = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'v:0',
+                             '-show_entries', 'stream=width,height:stream_tags=rotate:format=duration:format_tags=creation_time',
+                             '-of', 'json', filepath],
+                            check=True, capture_output=True, timeout=30, stdin=subprocess.DEVNULL).stdout
+    info = json.loads(output)
+    streams = info.get('streams') or [{}]
+    fmt = info.get('format', {})
+    width, height = streams[0].get('width'), streams[0].get('height')
+    if streams[0].get('tags', {}).get('rotate') in ('90', '270', '-90'):
+        width, height = height, width
+    duration = float(fmt['duration']) if 'duration' in fmt else None
+    taken_at = _iso_time(fmt.get('tags', {}).get('creation_time'))
+    return width, height, taken_at, None, duration, None, None, None, None
+
+
+def _track_metadata(filepath):
+    """
+    Read start time, duration and bounding box of a GPX track.
+
+    Args:
+        filepath (str): Path to the track
+
+    Returns:
+        tuple: Metadata in the order of NO_METADATA
+    """
+    start, end, bbox = track_summary(filepath)
+    taken_at, finished_at = _iso_time(start), _iso_time(end)
+    duration = finished_at - taken_at if taken_at is not None and finished_at is not None else None
+    return (None, None, taken_at, None, duration) + (bbox or (None,) * 4)
+
+
+def extract_metadata(filepath, mimetype, ffprobe):
+    """
+    Extract the metadata of a file according to its type.
+
+    Args:
+        filepath (str): Path to the file
+        mimetype (str): Coarse MIME type of the file
+        ffprobe (str): Path to the ffprobe binary
+
+    Returns:
+        tuple: (width, height, taken_at, orientation, duration, min_lat, min_lon,
+            max_lat, max_lon), with None for unknown values
+    """
+    try:
+        if mimetype == 'image':
+            return _image_metadata(filepath)
+        if mimetype == 'video':
+            return _video_metadata(filepath, ffprobe)
+        if mimetype == 'maptrack':
+            return _track_metadata(filepath)
+    except Exception:
+        pass
+    return NO_METADATA
+
+
+def _extract_batch(files, ffprobe):
+    """
+    Extract the metadata of a batch of files in a worker process.
+
+    Args:
+        files (list): List of (path, mimetype) tuples
+        ffprobe (str): Path to the ffprobe binary
+
+    Returns:
+        list: Metadata tuples returned by extract_metadata(), in the same order
+    """
+    return [extract_metadata(path, mimetype, ffprobe) for path, mimetype in files]
+
+
+def sort_key(taken_at, mtime_ns, md5):
+    """
+    Build the listing sort key of a file: capture time, or modification time when
+    unknown, as fixed-width seconds, then the MD5 to keep keys unique.
+
+    Args:
+        taken_at (int): Capture time in Unix seconds or None
+        mtime_ns (int): Modification time in nanoseconds or None
+        md5 (str): MD5 hash of the file path
+
+    Returns:
+        str: Sort key
+    """
+    seconds = taken_at if taken_at is not None else (mtime_ns or 0) // 1000000000
+    return f'{max(seconds, 0):011d}:{md5}'
+
+
+def describe_metadata(app, files):
+    """
+    Extract the metadata of many files on the process pool, METADATA_BATCH_SIZE files per task.
+
+    Args:
+        app: Flask application instance
+        files (list): List of (path, mimetype) tuples
+
+    Returns:
+        list: Metadata tuples returned by extract_metadata(), in the same order
+    """
+    batches = [files[i:i + METADATA_BATCH_SIZE] for i in range(0, len(files), METADATA_BATCH_SIZE)]
+    results = _get_executor(app).map(_extract_batch, batches, repeat(app.config['FFPROBE_BINARY']))
+    return [metadata for batch in results for metadata in batch]
+
+
+def _stat_row(file):
+    """
+    Stat the file of a record if its metadata or stored size and mtime are out of date.
+
+    Args:
+        file (sqlite3.Row): File record
+
+    Returns:
+        os.stat_result or None: File status, or None if the metadata is current or the file is gone
+    """
+    try:
+        st = os.stat(file['path'])
+    except OSError:
+        return None
+    if file['meta_mtime_ns'] == file['mtime_ns'] == st.st_mtime_ns and file['size'] == st.st_size:
+        return None
+    return st
+
+
+def refresh_share_metadata(app, sharemd5):
+    """
+    Re-extract the metadata of files of a share that changed since it was extracted.
+    Files are stat'ed concurrently on the scan pool; files whose mtime and size
+    match the stored ones are skipped. Fingerprints of changed files are cleared,
+    so this single sweep also finds the files to fingerprint again.
+
+    Args:
+        app: Flask application instance
+        sharemd5 (str): MD5 hash of the share
+
+    Returns:
+        int: Number of files whose metadata was extracted
+    """
+    executor = get_scan_executor()
+    done = 0
+    after = None
+    while True:
+        files = iter_share_files(app, sharemd5, after, app.config['INDEXER_BATCH_SIZE']).fetchall()
+        if not files:
+            return done
+        after = files[-1]['md5']
+
+        changed = [(file, st) for file, st in zip(files, executor.map(_stat_row, files)) if st is not None]
+        if not changed:
+            continue
+        metadata = describe_metadata(app, [(file['path'], file['mimetype']) for file, _st in changed])
+        rows = [(file['md5'], st.st_size, st.st_mtime_ns) + values +
+                (st.st_mtime_ns, sort_key(values[2], st.st_mtime_ns, file['md5']))
+                for (file, st), values in zip(changed, metadata)]
+        set_file_metadata(app, sharemd5, rows)
+        done += len(rows)
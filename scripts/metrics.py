@@ -0,0 +1,228 @@
+"""
+Metrics module for homeCloud application.
+Contains per-route request metrics in Prometheus text format and the opt-in
+profiler that dumps pstats files for slow requests.
+"""
+
+import cProfile
+import os
+import random
+import threading
+import time
+
+from flask import g, request
+
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Metrics of this process, guarded by _metrics_lock:
+# (route, method) -> [bucket counts..., +Inf count, sum of seconds]
+_latency = {}
+# (route, method, status) -> count
+_requests = {}
+# route -> [queries, seconds]
+_db = {}
+# file handler name -> bytes
+_bytes_served = {}
+_metrics_lock = threading.Lock()
+
+# Only one request is profiled at a time: profilers of concurrent requests
+# sharing a thread (gevent) would replace each other
+_profile_lock = threading.Lock()
+
+
+def record_query(seconds):
+    """
+    Count a database query in the current request.
+
+    Args:
+        seconds (float): Time spent executing the query
+    """
+    g.db_queries = g.get('db_queries', 0) + 1
+    g.db_seconds = g.get('db_seconds', 0.0) + seconds
+
+
+def record_handler(name):
+    """
+    Remember which file handler served the current request, for bytes served per handler.
+
+    Args:
+        name (str): Handler name
+    """
+    g.metrics_handler = name
+
+
+def _route():
+    """
+    Get the route label of the current request.
+
+    Returns:
+        str: URL rule of the request, or 'unmatched'
+    """
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _observe(response):
+    """
+    Record latency, status, database and bytes served metrics of a finished request.
+
+    Args:
+        response: Flask response object
+    """
+    elapsed = time.perf_counter() - g.metrics_start
+    route = _route()
+    with _metrics_lock:
+        histogram = _latency.setdefault((route, request.method), [0] * (len(LATENCY_BUCKETS) + 2))
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                histogram[i] += 1
+        histogram[-2] += 1
+        histogram[-1] += elapsed
+
+        key = (route, request.method, response.status_code)
+        _requests[key] = _requests.get(key, 0) + 1
+
+        db = _db.setdefault(route, [0, 0.0])
+        db[0] += g.get('db_queries', 0)
+        db[1] += g.get('db_seconds', 0.0)
+
+        handler = g.get('metrics_handler')
+        if handler is not None and response.content_length:
+            _bytes_served[handler] = _bytes_served.get(handler, 0) + response.content_length
+    return elapsed
+
+
+def _start_profiler(app):
+    """
+    Start profiling the current request if it is sampled and no other request is profiled.
+
+    Args:
+        app: Flask application instance
+    """
+    if random.random() >= app.config['PROFILE_SAMPLE_RATE'] or not _profile_lock.acquire(blocking=False):
+        return
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+def _stop_profiler(app, elapsed):
+    """
+    Stop the profiler of the current request and dump its stats if the request was slow.
+    Files can be inspected with pstats, snakeviz or converted to flame graphs with flameprof.
+
+    Args:
+        app: Flask application instance
+        elapsed (float): Request duration in seconds
+    """
+    profiler = g.pop('profiler')
+    profiler.disable()
+    _profile_lock.release()
+    if elapsed * 1000 < app.config['PROFILE_SLOW_MS']:
+        return
+    folder = os.path.join(app.root_path, app.config['PROFILE_FOLDER'])
+    os.makedirs(folder, exist_ok=True)
+    name = request.endpoint or 'unmatched'
+    profiler.dump_stats(os.path.join(folder, f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{int(elapsed * 1000)}ms.pstats'))
+
+
+def init_metrics(app):
+    """
+    Register request hooks collecting metrics and, when PROFILE_SLOW_MS is set,
+    profiling sampled requests.
+
+    Args:
+        app: Flask application instance
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        if app.config['PROFILE_SLOW_MS']:
+            _start_profiler(app)
+
+    @app.after_request
+    def finish_request_metrics(response):
+        # Streamed bodies are produced after this hook and are not included
+        elapsed = _observe(response)
+        if 'profiler' in g:
+            _stop_profiler(app, elapsed)
+        return response
+
+    @app.teardown_request
+    def release_profiler(error):
+        # Requests failing before after_request still release the profiler
+        if 'profiler' in g:
+            g.pop('profiler').disable()
+            _profile_lock.release()
+
+
+def _labels(**labels):
+    """
+    Format Prometheus labels.
+
+    Args:
+        **labels: Label names and values
+
+    Returns:
+        str: Label set in braces
+    """
+    values = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                      for name, value in labels.items())
+    return '{' + values + '}'
+
+
+def render_metrics(caches):
+    """
+    Render the metrics of this process in the Prometheus text format.
+
+    Args:
+        caches (dict): Cache name -> counters with 'hits' and 'misses'
+
+    Returns:
+        str: Metrics text
+    """
+    lines = []
+    with _metrics_lock:
+        lines.append('# HELP homecloud_request_duration_seconds Request latency by route.')
+        lines.append('# TYPE homecloud_request_duration_seconds histogram')
+        for (route, method), histogram in sorted(_latency.items()):
+            for bound, count in zip(LATENCY_BUCKETS, histogram):
+                lines.append('homecloud_request_duration_seconds_bucket'
+                             f'{_labels(route=route, method=method, le=bound)} {count}')
+            lines.append('homecloud_request_duration_seconds_bucket'
+                         f'{_labels(route=route, method=method, le="+Inf")} {histogram[-2]}')
+            lines.append(f'homecloud_request_duration_seconds_count{_labels(route=route, method=method)} {histogram[-2]}')
+            lines.append(f'homecloud_request_duration_seconds_sum{_labels(route=route, method=method)} {histogram[-1]:.6f}')
+
+        lines.append('# HELP homecloud_requests_total Requests by route and status.')
+        lines.append('# TYPE homecloud_requests_total counter')
+        for (route, method, status), count in sorted(_requests.items()):
+            lines.append(f'homecloud_requests_total{_labels(route=route, method=method, status=status)} {count}')
+
+        lines.append('# HELP homecloud_db_queries_total Database queries by route.')
+        lines.append('# TYPE homecloud_db_queries_total counter')
+        for route, (queries, _seconds) in sorted(_db.items()):
+            lines.append(f'homecloud_db_queries_total{_labels(route=route)} {queries}')
+        lines.append('# HELP homecloud_db_seconds_total Time spent executing database queries by route.')
+        lines.append('# TYPE homecloud_db_seconds_total counter')
+        for route, (_queries, seconds) in sorted(_db.items()):
+            lines.append(f'homecloud_db_seconds_total{_labels(route=route)} {seconds:.6f}')
+
+        lines.append('# HELP homecloud_served_bytes_total Bytes of files served by handler.')
+        lines.append('# TYPE homecloud_served_bytes_total counter')
+        for handler, count in sorted(_bytes_served.items()):
+            lines.append(f'homecloud_served_bytes_total{_labels(handler=handler)} {count}')
+
+    lines.append('# HELP homecloud_cache_requests_total Cache lookups by cache and result.')
+    lines.append('# TYPE homecloud_cache_requests_total counter')
+    for name, stats in sorted(caches.items()):
+        lines.append(f'homecloud_cache_requests_total{_labels(cache=name, result="hit")} {stats["hits"]}')
+        lines.append(f'homecloud_cache_requests_total{_labels(cache=name, result="miss")} {stats["misses"]}')
+    lines.append('# HELP homecloud_cache_hit_ratio Share of cache lookups served from memory.')
+    lines.append('# TYPE homecloud_cache_hit_ratio gauge')
+    for name, stats in sorted(caches.items()):
+        total = stats['hits'] + stats['misses']
+        lines.append(f'homecloud_cache_hit_ratio{_labels(cache=name)} {stats["hits"] / total if total else 0:.4f}')
+    return '\n'.join(lines) + '\n'
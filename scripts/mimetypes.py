@@ -3,55 +3,202 @@ MIME type handling module for homeCloud application.
 Contains functions for determining file types and serving files based on their MIME types.
 """
 
-from flask import send_file
+import os
+import threading
+from mimetypes import guess_type
+from urllib.parse import quote
+
+from flask import current_app, request, send_file
+
+from scripts.metrics import record_handler
+
+try:
+    import magic
+except ImportError:
+    # python-magic needs the libmagic system library
+    magic = None
 
 # Mapping of MIME types to file extensions
 mimetypes_extensions_map = {
-    "video": ["mp4"],
+    "video": ["mp4", "m4v", "mov", "webm"],
     "maptrack": ["gpx"],
-    "image": ["jpg", "png", "jpeg"],
+    "image": ["jpg", "png", "jpeg", "gif", "webp"],
     "unknown": []
 }
 mimetype_unknown = "unknown"
 
+# Per-thread libmagic handles
+_magic_local = threading.local()
+
+# Reverse index of mimetypes_extensions_map: extension -> MIME type
+_extension_index = {extension: mimetype
+                    for mimetype, extensions in mimetypes_extensions_map.items()
+                    for extension in extensions}
+
+# Content types the standard library does not know
+content_type_overrides = {
+    "gpx": "application/gpx+xml"
+}
+
+# Mapping of sniffed content types to MIME types, for files with unknown extensions
+content_type_groups = {
+    "image/jpeg": "image",
+    "image/png": "image",
+    "image/gif": "image",
+    "image/webp": "image",
+    "video/mp4": "video",
+    "video/quicktime": "video",
+    "video/webm": "video",
+    "application/gpx+xml": "maptrack"
+}
+
+
+def _file_etag(st):
+    """
+    Build an ETag from file identity and version.
+
+    Args:
+        st (os.stat_result): File status
+
+    Returns:
+        str: ETag value based on inode, mtime and size
+    """
+    return f'{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}'
+
+
+def _cache_max_age(immutable):
+    """
+    Get the Cache-Control max age for the current file request.
+    Responses whose URL carries the file's current version token never change
+    their content and may be cached for a year.
+
+    Args:
+        immutable (bool): Whether the request carries the current version token
+
+    Returns:
+        int: Max age in seconds
+    """
+    if immutable:
+        return 365 * 24 * 3600
+    return current_app.config['SEND_FILE_MAX_AGE']
+
+
+def sendStatic(filepath, mimetype=None, as_attachment=False, fingerprint=None, immutable=False):
+    """
+    Send a file with conditional request, byte range and proxy offload support.
+    Responses carry an ETag and Last-Modified so revalidation is answered with 304,
+    and Range requests are answered with 206 so videos can be seeked.
+    With SENDFILE_BACKEND set to x-accel, files below UPLOAD_FOLDER are handed to
+    nginx with X-Accel-Redirect; with x-sendfile, Flask emits X-Sendfile instead.
+
+    Args:
+        filepath (str): Path to the file
+        mimetype (str): Content type, guessed from the file name if not given
+        as_attachment (bool): Send as a download instead of inline
+        fingerprint (str): Current content fingerprint of the file, used as the
+            ETag so duplicates in several shares revalidate alike
+        immutable (bool): Cache the response as immutable; only for URLs whose
+            version token was checked against the file's current version
+
+    Returns:
+        Response: Flask file response
+    """
+    st = os.stat(filepath)
+    etag = fingerprint or _file_etag(st)
+    max_age = _cache_max_age(immutable)
+    response = None
+    if mimetype is None:
+        mimetype = content_type_overrides.get(os.path.splitext(filepath)[1][1:].lower())
+
+    if current_app.config['SENDFILE_BACKEND'] == 'x-accel':
+        root = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+        abs_path = os.path.abspath(filepath)
+        if os.path.commonpath([root, abs_path]) == root:
+            mimetype = mimetype or guess_type(filepath)[0] or 'application/octet-stream'
+            response = current_app.response_class(mimetype=mimetype)
+            rel_path = os.path.relpath(abs_path, root).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = current_app.config['X_ACCEL_PREFIX'] + quote(rel_path)
+            if as_attachment:
+                response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(os.path.basename(filepath))}"
+            response.set_etag(etag)
+            response.last_modified = st.st_mtime
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            # nginx serves the body and handles Range itself
+            response = response.make_conditional(request, accept_ranges=False)
+
+    if response is None:
+        response = send_file(filepath, mimetype=mimetype, as_attachment=as_attachment,
+                             conditional=True, etag=etag, last_modified=st.st_mtime, max_age=max_age)
+
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
 
-def sendImage(filepath):
+def sendImage(filepath, contentType=None, fingerprint=None, immutable=False):
     """
     Send image file with appropriate MIME type.
 
     Args:
         filepath (str): Path to the image file
+        contentType (str): Exact content type detected at index time
+        fingerprint (str): Current content fingerprint of the file
+        immutable (bool): Cache the response as immutable
 
     Returns:
         Response: Flask file response for image
     """
-    return send_file(filepath, mimetype='image/jpeg')
+    return sendStatic(filepath, mimetype=contentType or guess_type(filepath)[0] or 'image/jpeg', fingerprint=fingerprint, immutable=immutable)
 
 
-def sendVideo(filepath):
+def sendVideo(filepath, contentType=None, fingerprint=None, immutable=False):
     """
     Send video file for streaming.
+    Byte range requests let players seek without restarting the transfer.
 
     Args:
         filepath (str): Path to the video file
+        contentType (str): Exact content type detected at index time
+        fingerprint (str): Current content fingerprint of the file
+        immutable (bool): Cache the response as immutable
 
     Returns:
         Response: Flask file response for video
     """
-    return send_file(filepath, as_attachment=False)
+    return sendStatic(filepath, mimetype=contentType, as_attachment=False, fingerprint=fingerprint, immutable=immutable)
 
 
-def sentFileBlob(filepath):
+def sentFileBlob(filepath, contentType=None, fingerprint=None, immutable=False):
     """
     Send file as binary blob.
 
     Args:
         filepath (str): Path to the file
+        contentType (str): Exact content type detected at index time
+        fingerprint (str): Current content fingerprint of the file
+        immutable (bool): Cache the response as immutable
 
     Returns:
         Response: Flask file response
     """
-    return send_file(filepath)
+    return sendStatic(filepath, mimetype=contentType, fingerprint=fingerprint, immutable=immutable)
+
+
+def sendGeneric(filepath, contentType=None, fingerprint=None, immutable=False):
+    """
+    Send a file of any other type for download.
+
+    Args:
+        filepath (str): Path to the file
+        contentType (str): Exact content type detected at index time
+        fingerprint (str): Current content fingerprint of the file
+        immutable (bool): Cache the response as immutable
+
+    Returns:
+        Response: Flask file response
+    """
+    return sendStatic(filepath, mimetype=contentType, as_attachment=True, fingerprint=fingerprint, immutable=immutable)
 
 
 # Mapping of MIME types to their corresponding send functions
@@ -65,6 +212,7 @@ mimetypes_returns = {
 def getmimeType(extension):
     """
     Determine MIME type based on file extension.
+    Extensions are compared case-insensitively.
 
     Args:
         extension (str): File extension (without dot)
@@ -72,21 +220,70 @@ def getmimeType(extension):
     Returns:
         str: MIME type string or "unknown" if not recognized
     """
-    for key, values in mimetypes_extensions_map.items():
-        if extension in values:
-            return key
-    return "unknown"
+    return _extension_index.get(extension.lower(), mimetype_unknown)
+
+
+def _sniffContentType(filepath):
+    """
+    Detect the content type of a file from its contents with libmagic.
+    Each thread gets its own libmagic handle: the shared one serializes calls,
+    which would undo concurrent scanning.
+
+    Args:
+        filepath (str): Path to the file
+
+    Returns:
+        str or None: Content type or None if libmagic is unavailable or fails
+    """
+    if magic is None:
+        return None
+    try:
+        if not hasattr(_magic_local, 'magic'):
+            _magic_local.magic = magic.Magic(mime=True)
+        return _magic_local.magic.from_file(filepath)
+    except Exception:
+        return None
+
+
+def detectMimeType(filepath):
+    """
+    Determine MIME type and exact content type of a file.
+    The extension is looked up first; files with unknown extensions are
+    sniffed with libmagic.
+
+    Args:
+        filepath (str): Path to the file
+
+    Returns:
+        tuple: (MIME type string or "unknown", exact content type or None)
+    """
+    extension = os.path.splitext(filepath)[1][1:].lower()
+    mimetype = _extension_index.get(extension, mimetype_unknown)
+    contentType = content_type_overrides.get(extension) or guess_type(filepath)[0]
+    if mimetype == mimetype_unknown or contentType is None:
+        sniffed = _sniffContentType(filepath)
+        if sniffed is not None:
+            contentType = contentType or sniffed
+            if mimetype == mimetype_unknown:
+                mimetype = content_type_groups.get(sniffed, mimetype_unknown)
+    return mimetype, contentType
 
 
-def getFileByMimetype(mimetype, filePath):
+def getFileByMimetype(mimetype, filePath, contentType=None, fingerprint=None, immutable=False):
     """
     Serve file using appropriate handler based on MIME type.
+    Types without a dedicated handler are sent with the generic handler.
 
     Args:
         mimetype (str): MIME type of the file
         filePath (str): Path to the file
+        contentType (str): Exact content type detected at index time
+        fingerprint (str): Current content fingerprint of the file
+        immutable (bool): Cache the response as immutable
 
     Returns:
         Response: Flask file response using appropriate handler
     """
-    return mimetypes_returns[mimetype](filePath)
+    handler = mimetypes_returns.get(mimetype, sendGeneric)
+    record_handler(handler.__name__)
+    return handler(filePath, contentType, fingerprint, immutable)
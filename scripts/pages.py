@@ -0,0 +1,141 @@
+"""
+Page cache module for homeCloud application.
+Contains the in-process cache of rendered pages and fragments, kept per
+template, language and data version, with compressed bodies reused across requests.
+"""
+
+import gzip
+import hashlib
+import threading
+
+from flask import current_app, render_template, request
+
+try:
+    import brotli
+except ImportError:
+    # Optional, pages are only compressed with gzip without it
+    brotli = None
+
+from scripts.cache import LRUCache
+from helpers import get_locale, etag_matches
+
+
+class _Page:
+    """
+    Rendered page body, its ETag and its compressed bodies by encoding.
+    """
+
+    def __init__(self, body):
+        """
+        Args:
+            body (bytes): Rendered HTML
+        """
+        self.body = body
+        self.etag = hashlib.md5(body).hexdigest()
+        self.encoded = {}
+        self.lock = threading.Lock()
+
+    def encode(self, encoding, app):
+        """
+        Get the body compressed with an encoding, compressing it on first use.
+
+        Args:
+            encoding (str): 'br' or 'gzip'
+            app: Flask application instance
+
+        Returns:
+            bytes: Compressed body
+        """
+        with self.lock:
+            if encoding not in self.encoded:
+                if encoding == 'br':
+                    self.encoded[encoding] = brotli.compress(self.body, quality=app.config['COMPRESS_BR_LEVEL'])
+                else:
+                    self.encoded[encoding] = gzip.compress(self.body, compresslevel=app.config['COMPRESS_LEVEL'])
+            return self.encoded[encoding]
+
+
+def init_pages(app):
+    """
+    Create the page cache of an application.
+
+    Args:
+        app: Flask application instance
+    """
+    app.extensions['page_cache'] = LRUCache(app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_TTL'])
+
+
+def page_cache_stats(app):
+    """
+    Get hit and miss counters of the page cache.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        dict: Hits, misses, current number of entries and version
+    """
+    return app.extensions['page_cache'].stats()
+
+
+def cached_fragment(key, build):
+    """
+    Get a fragment from the page cache, building and storing it on a miss.
+    The key must include the version of the data the fragment is built from.
+
+    Args:
+        key (tuple): Fragment key
+        build (callable): Function building the fragment
+
+    Returns:
+        Cached or freshly built fragment
+    """
+    cache = current_app.extensions['page_cache']
+    hit, value = cache.get(('fragment',) + key)
+    if not hit:
+        version = cache.version
+        value = build()
+        cache.set(('fragment',) + key, value, version)
+    return value
+
+
+def render_page(template, key=(), **context):
+    """
+    Render a template through the page cache.
+    Pages are cached per template, language and key, which must hold the version
+    of any data the page shows, and are served with an ETag and the compressed
+    body the client accepts, so cached pages cost neither rendering nor compression.
+    Pages using the session beyond the language, such as flashed messages, must not be cached.
+
+    Args:
+        template (str): Template name
+        key (tuple): Data version and arguments the page depends on
+        **context: Template context, only used on a cache miss
+
+    Returns:
+        HTML response, or 304 if the client has the page cached
+    """
+    app = current_app._get_current_object()
+    cache = app.extensions['page_cache']
+    cache_key = ('page', template, get_locale()) + tuple(key)
+    hit, page = cache.get(cache_key)
+    if not hit:
+        version = cache.version
+        page = _Page(render_template(template, **context).encode('utf-8'))
+        cache.set(cache_key, page, version)
+
+    encodings = [encoding for encoding in app.config['COMPRESS_ALGORITHM']
+                 if encoding in ('br', 'gzip') and (encoding != 'br' or brotli is not None)
+                 and request.accept_encodings[encoding]]
+    encoding = encodings[0] if encodings else None
+    if etag_matches(page.etag):
+        response = app.response_class(status=304)
+    elif encoding is not None:
+        response = app.response_class(page.encode(encoding, app), mimetype='text/html')
+        response.content_encoding = encoding
+    else:
+        response = app.response_class(page.body, mimetype='text/html')
+    response.set_etag(page.etag if encoding is None else f'{page.etag}:{encoding}')
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True
+    return response
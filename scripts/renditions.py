@@ -0,0 +1,215 @@
+"""
+Display rendition module for homeCloud application.
+Contains the generation of screen-sized image renditions, chosen from viewport
+hints and encoded as AVIF, WebP or JPEG depending on what the client accepts,
+kept in a size-capped disk cache.
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+try:
+    # Registers the AVIF codec with Pillow
+    import pillow_avif
+except ImportError:
+    # Optional, renditions are encoded as WebP or JPEG without it
+    pillow_avif = None
+
+from scripts.cache import touch, maybe_prune
+
+# Long edges of the renditions in pixels, smallest first
+RENDITION_SIZES = (1920, 2560)
+
+# Output formats by preference: content type -> (Pillow format, file extension, save options)
+RENDITION_FORMATS = {
+    'image/avif': ('AVIF', '.avif', {'quality': 60, 'speed': 6}),
+    'image/webp': ('WEBP', '.webp', {'quality': 80, 'method': 4}),
+    'image/jpeg': ('JPEG', '.jpg', {'quality': 85, 'progressive': True, 'optimize': True})
+}
+
+# Images served as they are: animations would lose their frames
+RENDITION_SKIPPED_TYPES = ('image/gif',)
+
+_executor = None
+_executor_lock = threading.Lock()
+# Renditions being generated in this process: cache path -> Future
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def _get_executor(app):
+    """
+    Get the process pool used for rendition generation, creating it on first use.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        ProcessPoolExecutor: Rendition worker pool
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=app.config['RENDITION_WORKERS'])
+        return _executor
+
+
+def _supported(content_type):
+    """
+    Check whether Pillow can encode a rendition format.
+
+    Args:
+        content_type (str): Content type in RENDITION_FORMATS
+
+    Returns:
+        bool: True if the format can be written
+    """
+    if content_type == 'image/avif':
+        return 'AVIF' in Image.SAVE
+    if content_type == 'image/webp':
+        return features.check('webp')
+    return True
+
+
+def choose_format(accept_mimetypes):
+    """
+    Choose the rendition format from the request's Accept header.
+    AVIF is preferred over WebP, and JPEG is sent to clients accepting neither.
+
+    Args:
+        accept_mimetypes: Request accept_mimetypes
+
+    Returns:
+        str: Content type in RENDITION_FORMATS
+    """
+    # Only explicit mentions count: browsers send */* for images too
+    accepted = {value for value, quality in accept_mimetypes if quality > 0}
+    for content_type in ('image/avif', 'image/webp'):
+        if content_type in accepted and _supported(content_type):
+            return content_type
+    return 'image/jpeg'
+
+
+def choose_size(edge):
+    """
+    Choose the rendition size for the long edge the client displays.
+
+    Args:
+        edge (int): Long edge of the viewport in device pixels, or None if unknown
+
+    Returns:
+        int: Smallest rendition size covering the edge, or the largest one
+    """
+    if edge is None:
+        return RENDITION_SIZES[0]
+    for size in RENDITION_SIZES:
+        if size >= edge:
+            return size
+    return RENDITION_SIZES[-1]
+
+
+def _render(src, dst, size, fmt, options):
+    """
+    Render a rendition in a worker process.
+    JPEG draft mode lets the decoder downscale while decoding; the EXIF orientation
+    is applied to the pixels, and the color profile is kept.
+    The file is written under a temporary name and moved into place atomically.
+
+    Args:
+        src (str): Source image path
+        dst (str): Destination path
+        size (int): Longest edge in pixels
+        fmt (str): Pillow format name
+        options (dict): Pillow save options
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f'{dst}.{os.getpid()}.tmp'
+    try:
+        with Image.open(src) as img:
+            img.draft('RGB', (size, size))
+            icc_profile = img.info.get('icc_profile')
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((size, size), Image.LANCZOS)
+            alpha = 'A' in img.getbands() or 'transparency' in img.info
+            mode = 'RGBA' if alpha and fmt != 'JPEG' else 'RGB'
+            if img.mode != mode:
+                img = img.convert(mode)
+            if icc_profile:
+                options = dict(options, icc_profile=icc_profile)
+            img.save(tmp, fmt, **options)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def rendition_path(app, md5, filepath, size, content_type, fingerprint=None):
+    """
+    Get the cache path of a rendition.
+    Keyed like thumbnails: by content fingerprint when known, otherwise by file
+    MD5, mtime and size.
+
+    Args:
+        app: Flask application instance
+        md5 (str): MD5 hash of the file
+        filepath (str): Path to the file
+        size (int): Longest edge in pixels
+        content_type (str): Content type in RENDITION_FORMATS
+        fingerprint (str): Current content fingerprint of the file
+
+    Returns:
+        str: Path of the cached rendition
+    """
+    if fingerprint is not None:
+        key = hashlib.sha1(f'{fingerprint}:{size}'.encode('utf-8')).hexdigest()
+    else:
+        st = os.stat(filepath)
+        key = hashlib.sha1(f'{md5}:{st.st_mtime_ns}:{st.st_size}:{size}'.encode('utf-8')).hexdigest()
+    extension = RENDITION_FORMATS[content_type][1]
+    return os.path.join(app.root_path, app.config['RENDITION_CACHE_FOLDER'], key[:2], key + extension)
+
+
+def get_rendition(app, md5, filepath, size, content_type, fingerprint=None):
+    """
+    Get a rendition, generating it on the process pool if it is not cached.
+    The cache is pruned down to RENDITION_CACHE_MAX_BYTES, least recently used first.
+
+    Args:
+        app: Flask application instance
+        md5 (str): MD5 hash of the file
+        filepath (str): Path to the image
+        size (int): One of RENDITION_SIZES
+        content_type (str): Content type in RENDITION_FORMATS
+        fingerprint (str): Current content fingerprint of the file
+
+    Returns:
+        str or None: Path of the rendition or None if it could not be generated
+    """
+    try:
+        dst = rendition_path(app, md5, filepath, size, content_type, fingerprint)
+    except OSError:
+        return None
+    if os.path.exists(dst):
+        touch(dst)
+        return dst
+
+    fmt, _extension, options = RENDITION_FORMATS[content_type]
+    with _pending_lock:
+        future = _pending.get(dst)
+        if future is None:
+            future = _get_executor(app).submit(_render, filepath, dst, size, fmt, options)
+            _pending[dst] = future
+            future.add_done_callback(lambda _future: _pending.pop(dst, None))
+
+    try:
+        future.result(timeout=app.config['RENDITION_TIMEOUT'])
+    except Exception as e:
+        app.logger.warning('Rendition generation failed for %s: %s', filepath, e)
+        return None
+    maybe_prune(os.path.join(app.root_path, app.config['RENDITION_CACHE_FOLDER']),
+                app.config['RENDITION_CACHE_MAX_BYTES'])
+    return dst
@@ -0,0 +1,209 @@
+"""
+Folder scanning module for homeCloud application.
+Contains a single-pass directory scanner with a size cache keyed by directory path and mtime.
+Sibling directories are scanned concurrently on a thread pool, so on network
+storage scan time is bounded by I/O concurrency rather than round-trip latency.
+"""
+
+import os
+import threading
+import time
+from functools import partial
+
+from flask import current_app, has_app_context
+
+from scripts.concurrency import make_thread_pool
+
+# Scan threads and cache lifetime used outside of an application context
+DEFAULT_SCAN_WORKERS = 8
+DEFAULT_SCAN_CACHE_TTL = 300
+
+# Cache of scanned directory levels: path -> (mtime_ns, files_size, subdirectory names, read time)
+_dir_cache = {}
+_cache_lock = threading.Lock()
+# Directory listings served from the cache and listed again
+_cache_counters = {'hits': 0, 'misses': 0}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_scan_executor():
+    """
+    Get the thread pool used for directory scanning, creating it on first use.
+    Its size, SCAN_WORKERS, bounds the number of concurrent scandir and stat calls.
+
+    Returns:
+        concurrent.futures.Executor: Scan worker pool
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = current_app.config['SCAN_WORKERS'] if has_app_context() else DEFAULT_SCAN_WORKERS
+            _executor = make_thread_pool(workers, thread_name_prefix='scanner')
+        return _executor
+
+
+def _forget_subtree(path):
+    """
+    Drop cached entries for a directory and everything below it.
+
+    Args:
+        path (str): Path of the removed directory
+    """
+    prefix = path + os.sep
+    with _cache_lock:
+        _dir_cache.pop(path, None)
+        for key in [key for key in _dir_cache if key.startswith(prefix)]:
+            del _dir_cache[key]
+
+
+def forget_dir(path):
+    """
+    Drop the cached entries of a directory and everything below it, so their
+    sizes are read again on the next scan. Used when files were changed in place,
+    which leaves the directory mtime alone.
+
+    Args:
+        path (str): Directory path
+    """
+    _forget_subtree(path.rstrip(os.sep) or os.sep)
+
+
+def _cache_ttl():
+    """
+    Get the lifetime of cached directory levels.
+
+    Returns:
+        int: Seconds, SCAN_CACHE_TTL inside an application context
+    """
+    return current_app.config['SCAN_CACHE_TTL'] if has_app_context() else DEFAULT_SCAN_CACHE_TTL
+
+
+def read_dir(path, ttl=None):
+    """
+    Read a single directory level.
+    The directory is only listed again when its mtime differs from the cached one
+    or the cached entry is older than the TTL, otherwise the cached size of its
+    own files and its subdirectory names are reused. The TTL bounds how long
+    files rewritten in place, which keep the directory mtime, show a stale size.
+    Symlinked directories are not listed as subdirectories, so links out of the
+    tree are not counted and link cycles do not recurse.
+
+    Args:
+        path (str): Path of the directory
+        ttl (int): Lifetime of cached entries in seconds, SCAN_CACHE_TTL if not given
+
+    Returns:
+        tuple: (total size of files directly in the directory, sorted list of subdirectory names)
+    """
+    if ttl is None:
+        ttl = _cache_ttl()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return 0, []
+
+    now = time.monotonic()
+    cached = _dir_cache.get(path)
+    if cached is not None and cached[0] == mtime and now - cached[3] < ttl:
+        _cache_counters['hits'] += 1
+        return cached[1], cached[2]
+    _cache_counters['misses'] += 1
+
+    files_size = 0
+    subdirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_file():
+                        files_size += entry.stat().st_size
+                except OSError:
+                    pass
+    except OSError:
+        return 0, []
+    subdirs.sort()
+
+    if cached is not None:
+        for name in set(cached[2]) - set(subdirs):
+            _forget_subtree(os.path.join(path, name))
+
+    with _cache_lock:
+        _dir_cache[path] = (mtime, files_size, subdirs, now)
+    return files_size, subdirs
+
+
+def read_dirs(paths):
+    """
+    Read several directory levels concurrently.
+
+    Args:
+        paths (list): Directory paths
+
+    Returns:
+        list: read_dir() results in the order of paths
+    """
+    return list(get_scan_executor().map(partial(read_dir, ttl=_cache_ttl()), paths))
+
+
+def cache_stats():
+    """
+    Get hit and miss counters of the directory cache.
+    Counters are updated without locking and may miss concurrent updates.
+
+    Returns:
+        dict: Hits, misses and number of cached directories
+    """
+    return {'hits': _cache_counters['hits'], 'misses': _cache_counters['misses'], 'size': len(_dir_cache)}
+
+
+def scan_tree(path):
+    """
+    Scan a directory tree once, summing subtree sizes bottom-up.
+    Directories are read level by level, all directories of a level concurrently;
+    unchanged directories are served from the size cache.
+
+    Args:
+        path (str): Root directory to scan
+
+    Returns:
+        dict: Node with 'name', 'path', 'size_bytes' and 'children' (list of nodes)
+    """
+    executor = get_scan_executor()
+    read = partial(read_dir, ttl=_cache_ttl())
+    levels = {}
+    level = [path]
+    while level:
+        next_level = []
+        for dirpath, result in zip(level, executor.map(read, level)):
+            levels[dirpath] = result
+            next_level.extend(os.path.join(dirpath, name) for name in result[1])
+        level = next_level
+
+    def build(dirpath):
+        files_size, subdirs = levels[dirpath]
+        children = [build(os.path.join(dirpath, name)) for name in subdirs]
+        return {
+            'name': os.path.basename(dirpath),
+            'path': dirpath,
+            'size_bytes': files_size + sum(child['size_bytes'] for child in children),
+            'children': children
+        }
+
+    return build(path)
+
+
+def get_folder_size(path):
+    """
+    Calculate the total size of a folder recursively using the size cache.
+
+    Args:
+        path (str): Path to the folder
+
+    Returns:
+        int: Total size in bytes
+    """
+    return scan_tree(path)['size_bytes']
@@ -0,0 +1,60 @@
+"""
+Search module for homeCloud application.
+Contains the translation of user search text into FTS5 queries over the
+files_fts index and the paginated search used by the admin and guest endpoints.
+"""
+
+import re
+
+from scripts.db import search_files
+
+# Default and maximum number of matches returned per page
+SEARCH_PAGE_SIZE = 50
+SEARCH_PAGE_SIZE_MAX = 500
+# Matches ranked by relevance; broader searches list the remaining matches newest first
+SEARCH_RANK_WINDOW = 2000
+
+# Search terms: runs of letters and digits, as split by the index tokenizer
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def match_query(text):
+    """
+    Build an FTS5 query from user search text.
+    Every term must match the start of a word of the file name, folder or
+    metadata; FTS5 operators and syntax in the text are treated as plain words.
+
+    Args:
+        text (str): User search text
+
+    Returns:
+        str or None: FTS5 query, or None if the text has no searchable terms
+    """
+    terms = [term for term in _TERM_RE.findall(text or '') if term.strip('_')]
+    if not terms:
+        return None
+    return '{name folder meta} : (' + ' '.join(f'"{term}"*' for term in terms) + ')'
+
+
+def search(app, text, sharemd5=None, limit=None, offset=0):
+    """
+    Search indexed files, best matches first.
+
+    Args:
+        app: Flask application instance
+        text (str): User search text
+        sharemd5 (str): Only search files of this share
+        limit (int): Page size, clamped to SEARCH_PAGE_SIZE_MAX
+        offset (int): Number of matches to skip
+
+    Returns:
+        tuple: (list of file records, offset of the next page or None)
+    """
+    match = match_query(text)
+    if match is None:
+        return [], None
+    limit = max(1, min(limit or SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE_MAX))
+    offset = max(0, offset or 0)
+    # One extra row tells whether another page follows
+    files = search_files(app, match, sharemd5, limit + 1, offset, SEARCH_RANK_WINDOW)
+    return files[:limit], offset + limit if len(files) > limit else None
@@ -0,0 +1,216 @@
+"""
+Thumbnail generation module for homeCloud application.
+Contains the thumbnail service with an on-disk cache for images, videos and GPX tracks.
+"""
+
+import hashlib
+import os
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageOps
+
+from scripts.gpx import read_track, douglas_peucker
+
+# Thumbnail size names mapped to the longest edge in pixels
+THUMBNAIL_SIZES = {
+    'small': 160,
+    'medium': 320,
+    'large': 640
+}
+
+# MIME type groups thumbnails can be rendered for
+THUMBNAIL_MIMETYPES = ('image', 'video', 'maptrack')
+
+# Static images shown when no thumbnail can be generated
+THUMBNAIL_PLACEHOLDERS = {
+    'video': 'video_without_thumb.jpg',
+    'maptrack': 'map_without_thumb.jpg'
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+# Thumbnails being generated in this process: cache path -> Future
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def _get_executor(app):
+    """
+    Get the process pool used for thumbnail generation, creating it on first use.
+
+    Args:
+        app: Flask application instance
+
+    Returns:
+        ProcessPoolExecutor: Thumbnail worker pool
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=app.config['THUMBNAIL_WORKERS'])
+        return _executor
+
+
+def _render_image(src, dst, size):
+    """
+    Render an image thumbnail.
+    JPEG draft mode lets the decoder downscale while decoding, so large photos
+    are never decoded at full resolution.
+
+    Args:
+        src (str): Source image path
+        dst (str): Destination JPEG path
+        size (int): Longest edge in pixels
+    """
+    with Image.open(src) as img:
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        img.convert('RGB').save(dst, 'JPEG', quality=80)
+
+
+def _render_video(src, dst, size, ffmpeg):
+    """
+    Render a video thumbnail from a single frame grabbed with ffmpeg.
+
+    Args:
+        src (str): Source video path
+        dst (str): Destination JPEG path
+        size (int): Longest edge in pixels
+        ffmpeg (str): Path to the ffmpeg binary
+    """
+    # Skip the first second, which is often black; short clips use their first frame
+    for offset in ('1', '0'):
+        subprocess.run([ffmpeg, '-v', 'error', '-y', '-ss', offset, '-i', src, '-frames:v', '1',
+                        '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease',
+                        '-f', 'image2', '-c:v', 'mjpeg', dst],
+                       check=True, timeout=60, stdin=subprocess.DEVNULL)
+        if os.path.exists(dst) and os.path.getsize(dst) > 0:
+            return
+    raise ValueError('no video frame could be grabbed')
+
+
+def _render_track(src, dst, size):
+    """
+    Render a GPX track thumbnail as a polyline.
+
+    Args:
+        src (str): Source GPX path
+        dst (str): Destination JPEG path
+        size (int): Longest edge in pixels
+    """
+    track = read_track(src)
+    if len(track) < 2:
+        raise ValueError('track has less than two points')
+
+    # Equirectangular projection, good enough at thumbnail scale
+    xy = np.column_stack((track[:, 1] * np.cos(np.radians(track[:, 0].mean())), -track[:, 0]))
+    xy -= xy.min(axis=0)
+    span = float(xy.max()) or 1.0
+
+    margin = size // 16
+    xy = margin + xy * ((size - 2 * margin) / span)
+    # Drop points closer than a pixel to the drawn line
+    xy = xy[douglas_peucker(xy, 0.5)]
+    img = Image.new('RGB', (size, size), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.line([tuple(point) for point in xy.tolist()], fill='red', width=max(2, size // 100), joint='curve')
+    img.save(dst, 'JPEG', quality=80)
+
+
+def _generate(mimetype, src, dst, size, ffmpeg):
+    """
+    Generate a thumbnail in a worker process.
+    The file is written under a temporary name and moved into place atomically.
+
+    Args:
+        mimetype (str): MIME type group of the source file
+        src (str): Source file path
+        dst (str): Destination thumbnail path
+        size (int): Longest edge in pixels
+        ffmpeg (str): Path to the ffmpeg binary
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f'{dst}.{os.getpid()}.tmp'
+    try:
+        if mimetype == 'image':
+            _render_image(src, tmp, size)
+        elif mimetype == 'video':
+            _render_video(src, tmp, size, ffmpeg)
+        elif mimetype == 'maptrack':
+            _render_track(src, tmp, size)
+        else:
+            raise ValueError(f'no thumbnails for {mimetype}')
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def thumbnail_path(app, md5, filepath, size, fingerprint=None):
+    """
+    Get the cache path of a thumbnail.
+    The cache is keyed by the content fingerprint when known, so duplicates in
+    several shares share one thumbnail, and otherwise by file MD5, mtime and size;
+    a changed file gets a new thumbnail and stale ones are simply never read again.
+
+    Args:
+        app: Flask application instance
+        md5 (str): MD5 hash of the file
+        filepath (str): Path to the file
+        size (int): Longest edge in pixels
+        fingerprint (str): Current content fingerprint of the file
+
+    Returns:
+        str: Path of the cached thumbnail
+    """
+    if fingerprint is not None:
+        key = hashlib.sha1(f'{fingerprint}:{size}'.encode('utf-8')).hexdigest()
+    else:
+        st = os.stat(filepath)
+        key = hashlib.sha1(f'{md5}:{st.st_mtime_ns}:{st.st_size}:{size}'.encode('utf-8')).hexdigest()
+    return os.path.join(app.root_path, app.config['THUMBNAIL_FOLDER'], key[:2], key + '.jpg')
+
+
+def get_thumbnail(app, mimetype, filepath, md5, size_name, fingerprint=None):
+    """
+    Get a thumbnail, generating it on the process pool if it is not cached.
+
+    Args:
+        app: Flask application instance
+        mimetype (str): MIME type group of the file
+        filepath (str): Path to the file
+        md5 (str): MD5 hash of the file
+        size_name (str): One of THUMBNAIL_SIZES
+        fingerprint (str): Current content fingerprint of the file
+
+    Returns:
+        str or None: Path of the thumbnail or None if it could not be generated
+    """
+    if mimetype not in THUMBNAIL_MIMETYPES:
+        return None
+    size = THUMBNAIL_SIZES[size_name]
+    try:
+        dst = thumbnail_path(app, md5, filepath, size, fingerprint)
+    except OSError:
+        return None
+    if os.path.exists(dst):
+        return dst
+
+    executor = _get_executor(app)
+    with _pending_lock:
+        future = _pending.get(dst)
+        if future is None:
+            future = executor.submit(_generate, mimetype, filepath, dst, size, app.config['FFMPEG_BINARY'])
+            _pending[dst] = future
+            future.add_done_callback(lambda _future: _pending.pop(dst, None))
+
+    try:
+        future.result(timeout=app.config['THUMBNAIL_TIMEOUT'])
+    except Exception as e:
+        app.logger.warning('Thumbnail generation failed for %s: %s', filepath, e)
+        return None
+    return dst
@@ -0,0 +1,149 @@
+"""
+File system watcher module for homeCloud application.
+Contains the watcher that applies changes in shared folders to the files table.
+Uses inotify when the optional inotify_simple package is available and falls back to polling.
+"""
+
+import errno
+import time
+
+from scripts.db import get_all_shares, get_share_dirs
+from scripts.indexer import index_share
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# Quiet period after the last event before changes are applied, in milliseconds
+DEBOUNCE_MS = 1000
+
+
+def poll_shares(app, interval):
+    """
+    Re-index all shares periodically.
+    Each pass only lists directories whose mtime or inode changed; files edited
+    in place are found by the first pass and then every WATCHER_RECHECK_INTERVAL,
+    which stat every indexed file.
+
+    Args:
+        app: Flask application instance
+        interval (int): Seconds between passes
+    """
+    last_recheck = None
+    while True:
+        recheck = last_recheck is None or time.monotonic() - last_recheck >= app.config['WATCHER_RECHECK_INTERVAL']
+        if recheck:
+            last_recheck = time.monotonic()
+        for share in get_all_shares(app):
+            added, removed = index_share(app, share['md5'], share['path'], recheck=recheck)
+            if added or removed:
+                app.logger.info('Share %s: %d files added, %d removed', share['md5'], added, removed)
+        time.sleep(interval)
+
+
+class InotifyWatcher:
+    """
+    Watches every indexed directory of every share with inotify
+    and re-indexes only the directories that reported events.
+    """
+
+    WATCH_FLAGS = None if INotify is None else (
+        flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO |
+        flags.CLOSE_WRITE | flags.DELETE_SELF | flags.MOVE_SELF)
+
+    def __init__(self, app):
+        """
+        Args:
+            app: Flask application instance
+        """
+        self.app = app
+        self.inotify = INotify()
+        # Watch descriptor -> (share MD5, share path, directory path)
+        self.watches = {}
+        self.watched_paths = set()
+
+    def refresh_watches(self):
+        """
+        Add watches for all shares and directories that are not watched yet.
+        Shares that were never indexed are indexed first.
+        """
+        for share in get_all_shares(self.app):
+            dirs = get_share_dirs(self.app, share['md5'])
+            if not dirs:
+                index_share(self.app, share['md5'], share['path'])
+                dirs = get_share_dirs(self.app, share['md5'])
+            for dirpath in dirs:
+                if dirpath in self.watched_paths:
+                    continue
+                try:
+                    wd = self.inotify.add_watch(dirpath, self.WATCH_FLAGS)
+                except OSError as e:
+                    if e.errno == errno.ENOSPC:
+                        raise
+                    continue
+                self.watches[wd] = (share['md5'], share['path'], dirpath)
+                self.watched_paths.add(dirpath)
+
+    def run(self, interval):
+        """
+        Process events until interrupted.
+
+        Args:
+            interval (int): Seconds between checks for new shares
+        """
+        self.refresh_watches()
+        last_refresh = time.monotonic()
+        while True:
+            dirty = {}
+            overflow = False
+            events = self.inotify.read(timeout=interval * 1000)
+            while events:
+                for event in events:
+                    if event.mask & flags.Q_OVERFLOW:
+                        overflow = True
+                        continue
+                    watch = self.watches.get(event.wd)
+                    if watch is None:
+                        continue
+                    sharemd5, sharepath, dirpath = watch
+                    dirty.setdefault((sharemd5, sharepath), set()).add(dirpath)
+                    if event.mask & flags.IGNORED:
+                        del self.watches[event.wd]
+                        self.watched_paths.discard(dirpath)
+                events = self.inotify.read(timeout=DEBOUNCE_MS)
+
+            if overflow:
+                # Events were lost, fall back to a full incremental pass that also finds edited files
+                dirty = {(share['md5'], share['path']): None for share in get_all_shares(self.app)}
+
+            for (sharemd5, sharepath), dirs in dirty.items():
+                added, removed = index_share(self.app, sharemd5, sharepath, dirty=dirs, recheck=overflow)
+                if added or removed:
+                    self.app.logger.info('Share %s: %d files added, %d removed', sharemd5, added, removed)
+
+            if dirty or time.monotonic() - last_refresh >= interval:
+                self.refresh_watches()
+                last_refresh = time.monotonic()
+
+
+def watch_shares(app, interval):
+    """
+    Keep the files table of all shares in sync with the file system.
+    Uses inotify when available and falls back to polling otherwise,
+    for example when inotify_simple is not installed or the watch limit
+    (fs.inotify.max_user_watches) is reached.
+
+    Args:
+        app: Flask application instance
+        interval (int): Seconds between polling passes or checks for new shares
+    """
+    if INotify is not None:
+        try:
+            app.logger.info('Watching shares with inotify')
+            InotifyWatcher(app).run(interval)
+            return
+        except OSError as e:
+            app.logger.warning('inotify unavailable (%s), falling back to polling', e)
+    app.logger.info('Polling shares every %d seconds', interval)
+    poll_shares(app, interval)
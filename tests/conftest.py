@@ -0,0 +1,75 @@
+"""
+Shared fixtures for homeCloud tests.
+"""
+
+import os
+import tempfile
+
+# Importing the app module creates an application on the configured database;
+# point it at a throwaway file before config.py reads the environment
+os.environ.setdefault('DATABASE', os.path.join(tempfile.mkdtemp(), 'import.db'))
+
+import pytest
+from PIL import Image
+
+from app import create_app
+from scripts.db import init_db, add_share, get_share_files
+from scripts.indexer import index_share
+
+GPX = '''<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="tests" xmlns="http://www.topografix.com/GPX/1/1">
+  <trk><trkseg>
+    <trkpt lat="55.75" lon="37.61"></trkpt>
+    <trkpt lat="55.76" lon="37.62"></trkpt>
+  </trkseg></trk>
+</gpx>
+'''
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    Application on an empty database in a temporary folder.
+    """
+    app = create_app()
+    app.config.update(TESTING=True, DATABASE=str(tmp_path / 'test.db'))
+    with app.app_context():
+        init_db(app)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    """
+    Test client of the application.
+    """
+    return app.test_client()
+
+
+@pytest.fixture
+def share_folder(tmp_path):
+    """
+    Shared folder holding an image, a GPX track and a text file.
+    """
+    folder = tmp_path / 'share'
+    folder.mkdir()
+    Image.new('RGB', (8, 8), 'red').save(folder / 'photo.jpg')
+    (folder / 'track.gpx').write_text(GPX, encoding='utf-8')
+    (folder / 'notes.txt').write_text('notes', encoding='utf-8')
+    return folder
+
+
+@pytest.fixture
+def share(app, share_folder):
+    """
+    Indexed share of share_folder.
+
+    Returns:
+        tuple: (share MD5, dict of file name -> file record)
+    """
+    md5 = 'testshare'
+    with app.app_context():
+        add_share(app, md5, str(share_folder))
+        index_share(app, md5, str(share_folder))
+        files = {os.path.basename(file['path']): file for file in get_share_files(app, md5)}
+    return md5, files
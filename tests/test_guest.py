@@ -0,0 +1,22 @@
+"""
+Tests of the guest blueprint.
+"""
+
+
+def test_external_viewer_renders_track(client, share):
+    md5, files = share
+    response = client.get(f'/external-viewer/maptrack/{md5}/{files["track.gpx"]["md5"]}')
+    assert response.status_code == 200
+
+
+def test_external_viewer_unknown_file(client, share):
+    md5, _ = share
+    response = client.get(f'/external-viewer/maptrack/{md5}/missing')
+    assert response.status_code == 404
+
+
+def test_external_viewer_other_types(client, share):
+    md5, files = share
+    for name, viewer in (('photo.jpg', 'image'), ('notes.txt', 'unknown'), ('photo.jpg', 'maptrack')):
+        response = client.get(f'/external-viewer/{viewer}/{md5}/{files[name]["md5"]}')
+        assert response.status_code == 404
@@ -0,0 +1,25 @@
+"""
+Tests of the share indexer.
+"""
+
+import os
+
+from scripts.db import get_share_dirs, get_share_files
+from scripts.indexer import index_share
+
+
+def test_symlinked_directories_are_not_followed(app, share, share_folder, tmp_path):
+    md5, _ = share
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    (outside / 'secret.txt').write_text('secret', encoding='utf-8')
+    os.symlink(outside, share_folder / 'outside-link')
+    os.symlink(share_folder, share_folder / 'loop')
+
+    with app.app_context():
+        index_share(app, md5, str(share_folder))
+        paths = {file['path'] for file in get_share_files(app, md5)}
+        dirs = set(get_share_dirs(app, md5))
+
+    assert paths == {str(share_folder / name) for name in ('photo.jpg', 'track.gpx', 'notes.txt')}
+    assert dirs == {str(share_folder)}
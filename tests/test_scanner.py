@@ -0,0 +1,46 @@
+"""
+Tests of the folder scanner.
+"""
+
+import os
+
+from scripts.scanner import scan_tree, read_dir, get_folder_size, forget_dir
+
+
+def test_symlinked_directories_are_not_scanned(tmp_path):
+    root = tmp_path / 'root'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'sub' / 'file.bin').write_bytes(b'x' * 10)
+    outside = tmp_path / 'outside'
+    outside.mkdir()
+    (outside / 'big.bin').write_bytes(b'x' * 1000)
+    os.symlink(outside, root / 'outside-link')
+    os.symlink(root, root / 'sub' / 'loop')
+
+    tree = scan_tree(str(root))
+
+    assert [child['name'] for child in tree['children']] == ['sub']
+    assert tree['children'][0]['children'] == []
+    assert get_folder_size(str(root)) == 10
+
+
+def test_files_rewritten_in_place_are_read_again(tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    (root / 'file.bin').write_bytes(b'x' * 10)
+    assert get_folder_size(str(root)) == 10
+
+    # Rewriting a file keeps the directory mtime
+    mtime = os.stat(root).st_mtime_ns
+    (root / 'file.bin').write_bytes(b'x' * 20)
+    os.utime(root, ns=(mtime, mtime))
+    assert get_folder_size(str(root)) == 10
+
+    forget_dir(str(root))
+    assert get_folder_size(str(root)) == 20
+
+    # Expired entries are read again without being dropped
+    (root / 'file.bin').write_bytes(b'x' * 30)
+    os.utime(root, ns=(mtime, mtime))
+    assert read_dir(str(root)) == (20, [])
+    assert read_dir(str(root), ttl=0) == (30, [])